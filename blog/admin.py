@@ -1,9 +1,50 @@
 from django.contrib import admin
-from .models import Post, Comment, PostImage
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils import timezone
+from django.utils.functional import cached_property
+from .models import Post, Comment, PostImage, PublishJob
+from .cache import bump_content_version
+from .surrogate import schedule_purge, post_key
+from .publishing import restart_jobs
+from . import autocomplete
 
 # Register your models here.
 
 
+## Paginator using the planner's row estimate for big unfiltered tables
+class EstimatedCountPaginator(Paginator):
+    # below this many rows an exact COUNT(*) is cheap enough
+    ESTIMATE_THRESHOLD = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s',
+                               [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] >= self.ESTIMATE_THRESHOLD:
+                return int(row[0])
+        return super().count
+
+
+
+# Bulk actions run a single UPDATE, which sends no signals and skips auto_now,
+# so `updated` is set by hand and the caches, proxy and search index are
+# brought up to date here
+def content_updated(post_ids, listing_changed=False):
+    bump_content_version()
+    keys = [post_key(post_id) for post_id in post_ids]
+    if listing_changed:
+        keys += ['list', 'feed', 'sitemap']
+        autocomplete.invalidate()
+    schedule_purge(*keys)
+
+
+
 @admin.register(Post)
 class PostAdmin(admin.ModelAdmin):
     list_display = ['title', 'slug', 'author', 'published', 'status']
@@ -13,6 +54,28 @@ class PostAdmin(admin.ModelAdmin):
     raw_id_fields = ['author']
     date_hierarchy = 'published'
     ordering = ['status', 'published']
+    list_select_related = ['author']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['make_published', 'make_draft']
+
+    def set_status(self, request, queryset, status):
+        """Returns the ids of the posts, the queryset may no longer match them afterwards."""
+        post_ids = list(queryset.values_list('id', flat=True))
+        updated = Post.objects.filter(id__in=post_ids).update(status=status, updated=timezone.now())
+        content_updated(post_ids, listing_changed=True)
+        self.message_user(request, f'{updated} posts updated.')
+        return post_ids
+
+    @admin.action(description='Publish selected posts')
+    def make_published(self, request, queryset):
+        post_ids = self.set_status(request, queryset, Post.Status.PUBLISHED)
+        # let the publish pipeline warm their pages, again for posts it already went through
+        restart_jobs(post_ids)
+
+    @admin.action(description='Move selected posts back to draft')
+    def make_draft(self, request, queryset):
+        self.set_status(request, queryset, Post.Status.DRAFT)
 
 
 
@@ -21,11 +84,41 @@ class CommentAdmin(admin.ModelAdmin):
     list_display = ['name', 'email', 'post', 'created', 'active']
     list_filter = ['active', 'created', 'updated']
     search_fields = ['name', 'email', 'body']
+    list_select_related = ['post']
+    raw_id_fields = ['post']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['approve_comments', 'disapprove_comments']
+
+    def set_active(self, request, queryset, active):
+        post_ids = list(queryset.values_list('post_id', flat=True).distinct().order_by())
+        updated = queryset.update(active=active, updated=timezone.now())
+        content_updated(post_ids)
+        self.message_user(request, f'{updated} comments updated.')
+
+    @admin.action(description='Approve selected comments')
+    def approve_comments(self, request, queryset):
+        self.set_active(request, queryset, True)
+
+    @admin.action(description='Hide selected comments')
+    def disapprove_comments(self, request, queryset):
+        self.set_active(request, queryset, False)
 
 
 @admin.register(PostImage)
 class PostImageAdmin(admin.ModelAdmin):
     list_display = ['image', 'post']
+    list_select_related = ['post']
+    raw_id_fields = ['post']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
 
 
+
+@admin.register(PublishJob)
+class PublishJobAdmin(admin.ModelAdmin):
+    list_display = ['post', 'stage', 'state', 'attempts', 'run_after', 'last_error']
+    list_filter = ['state']
+    raw_id_fields = ['post']
+    list_select_related = ['post']
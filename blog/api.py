@@ -0,0 +1,219 @@
+import hashlib
+import json
+from functools import wraps
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse
+from django.urls import reverse
+from django.views.decorators.http import require_GET
+
+from .autocomplete import published_tags
+from .cache import cached, content_version
+from .models import Comment, Post
+from .surrogate import add_surrogate_keys, post_key, tag_key
+from .views import keyset_cursor, parse_keyset_cursor
+
+
+# Version 1 of the read only JSON API, mounted at /blog/api/v1/
+
+API_TIMEOUT = 60 * 15
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# public field name -> values() lookup
+POST_FIELDS = {
+    'id': 'id',
+    'title': 'title',
+    'slug': 'slug',
+    'author': 'author__username',
+    'published': 'published',
+    'updated': 'updated',
+    'body': 'body',
+}
+# fields built from the columns above, or from another query
+COMPUTED_POST_FIELDS = ('url', 'tags')
+
+# the body is only sent when asked for with ?fields=
+DEFAULT_POST_FIELDS = ('id', 'title', 'slug', 'published', 'url')
+DEFAULT_POST_DETAIL_FIELDS = DEFAULT_POST_FIELDS + ('author', 'updated', 'body', 'tags')
+
+COMMENT_FIELDS = ('id', 'name', 'body', 'created')
+
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+
+## Responses
+def api_view(build):
+    """
+    Serves build(request, **kwargs), returning (data, surrogate keys), as JSON.
+
+    The body is cached under the content version, which is also part of the
+    ETag, so requests for unchanged content are answered with 304 or from
+    the cache without touching the database.
+    """
+    @wraps(build)
+    def view(request, **kwargs):
+        version = content_version()
+        digest = hashlib.sha1(request.get_full_path().encode()).hexdigest()[:20]
+        etag = f'"{version}-{digest}"'
+
+        # compression weakens the ETag that is sent, so compare without the W/
+        if etag in [tag.strip().removeprefix('W/') for tag in request.headers.get('If-None-Match', '').split(',')]:
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+
+        try:
+            body, keys = cached(f'api:{version}:{digest}', lambda: render(build, request, kwargs), API_TIMEOUT)
+        except ApiError as exc:
+            return JsonResponse({'error': str(exc)}, status=exc.status)
+
+        add_surrogate_keys(request, *keys)
+        response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        return response
+
+    return require_GET(view)
+
+
+def render(build, request, kwargs):
+    data, keys = build(request, **kwargs)
+    return json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':')).encode(), keys
+
+
+
+## Query string handling
+def requested_fields(request, allowed, default):
+    if 'fields' not in request.GET:
+        return list(default)
+    fields = [field for field in request.GET['fields'].split(',') if field]
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise ApiError(f'Unknown fields: {", ".join(unknown)}. Available: {", ".join(allowed)}')
+    return fields
+
+
+def page_limit(request):
+    try:
+        limit = int(request.GET.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise ApiError('limit must be a number')
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def cursor_position(request):
+    cursor = request.GET.get('cursor')
+    if not cursor:
+        return None
+    try:
+        return parse_keyset_cursor(cursor)
+    except ValueError:
+        raise ApiError('Invalid cursor')
+
+
+def keyset_page(request, queryset, columns, timestamp):
+    """
+    One page of queryset.values(*columns), newest first, and the link to the
+    next page. queryset must have a before(timestamp, id) method.
+    """
+    position = cursor_position(request)
+    if position:
+        queryset = queryset.before(*position)
+    limit = page_limit(request)
+    rows = list(queryset.order_by(f'-{timestamp}', '-id').values(*columns)[:limit + 1])
+
+    next_page = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        query = request.GET.copy()
+        query['cursor'] = keyset_cursor(rows[-1][timestamp], rows[-1]['id'])
+        next_page = f'{request.path}?{query.urlencode()}'
+    return rows, next_page
+
+
+
+## Serialization straight from values() rows, no model instances
+def serialize_posts(rows, fields):
+    tags = {}
+    if 'tags' in fields:
+        pairs = Post.objects.filter(id__in=[row['id'] for row in rows]).values_list('id', 'tags__slug')
+        for post_id, slug in pairs:
+            if slug is not None:
+                tags.setdefault(post_id, []).append(slug)
+
+    items = []
+    for row in rows:
+        item = {}
+        for field in fields:
+            if field == 'url':
+                published = row['published']
+                item['url'] = reverse('blog:post_details',
+                                      args=[published.year, published.month, published.day, row['slug']])
+            elif field == 'tags':
+                item['tags'] = sorted(tags.get(row['id'], []))
+            else:
+                item[field] = row[POST_FIELDS[field]]
+        items.append(item)
+    return items
+
+
+def post_columns(fields):
+    columns = {'id', 'published'}
+    for field in fields:
+        if field == 'url':
+            columns.add('slug')
+        elif field in POST_FIELDS:
+            columns.add(POST_FIELDS[field])
+    return sorted(columns)
+
+
+def published_post(post_id):
+    if not Post.published_blogs.filter(id=post_id).exists():
+        raise ApiError('Post not found', status=404)
+
+
+
+## Endpoints
+@api_view
+def post_list(request):
+    fields = requested_fields(request, [*POST_FIELDS, *COMPUTED_POST_FIELDS], DEFAULT_POST_FIELDS)
+    posts = Post.published_blogs.all()
+    if request.GET.get('tag'):
+        posts = posts.filter(tags__slug=request.GET['tag'])
+
+    rows, next_page = keyset_page(request, posts, post_columns(fields), 'published')
+    keys = ['list', *[post_key(row['id']) for row in rows]]
+    return {'results': serialize_posts(rows, fields), 'next': next_page}, keys
+
+
+@api_view
+def post_detail(request, post_id):
+    fields = requested_fields(request, [*POST_FIELDS, *COMPUTED_POST_FIELDS], DEFAULT_POST_DETAIL_FIELDS)
+    rows = list(Post.published_blogs.filter(id=post_id).values(*post_columns(fields)))
+    if not rows:
+        raise ApiError('Post not found', status=404)
+    return serialize_posts(rows, fields)[0], [post_key(post_id)]
+
+
+@api_view
+def post_comments(request, post_id):
+    published_post(post_id)
+    fields = requested_fields(request, COMMENT_FIELDS, COMMENT_FIELDS)
+    comments = Comment.objects.filter(post_id=post_id, active=True)
+
+    rows, next_page = keyset_page(request, comments, sorted({'id', 'created', *fields}), 'created')
+    results = [{field: row[field] for field in fields} for row in rows]
+    return {'results': results, 'next': next_page}, [post_key(post_id)]
+
+
+@api_view
+def tag_list(request):
+    tags = list(published_tags().order_by('name').values('name', 'slug', 'num_posts'))
+    return {'results': tags}, [tag_key(tag['slug']) for tag in tags]
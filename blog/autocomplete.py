@@ -0,0 +1,205 @@
+import bisect
+import re
+import threading
+import unicodedata
+
+from django.db.models import Count, Q
+from django.urls import reverse
+from taggit.models import Tag
+
+from .cache import token_cache
+from .models import Post
+
+
+VERSION_KEY = 'autocomplete:version'
+
+WORD_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in text if not unicodedata.combining(c)).lower().strip()
+
+
+
+## In-memory prefix index of post titles and tag names
+class PrefixIndex:
+    """
+    Sorted array of terms with a parallel array of entry ids, searched with
+    bisect. Every entry (a post or a tag) is indexed under its whole label and
+    under each word of it, so "walk" finds "The River Walk" too.
+    """
+
+    def __init__(self):
+        self.terms = []
+        self.ids = []
+        self.entries = {}           # id -> (kind, label, url)
+        self.normalized = {}        # id -> normalized label
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def terms_for(label):
+        label = normalize(label)
+        words = WORD_RE.findall(label)
+        return sorted({label, *words[1:]})
+
+    def add(self, entry_id, kind, label, url):
+        with self.lock:
+            self._remove(entry_id)
+            self.entries[entry_id] = (kind, label, url)
+            self.normalized[entry_id] = normalize(label)
+            for term in self.terms_for(label):
+                position = bisect.bisect_right(self.terms, term)
+                self.terms.insert(position, term)
+                self.ids.insert(position, entry_id)
+
+    def remove(self, entry_id):
+        with self.lock:
+            self._remove(entry_id)
+
+    def _remove(self, entry_id):
+        entry = self.entries.pop(entry_id, None)
+        if entry is None:
+            return
+        del self.normalized[entry_id]
+        for term in self.terms_for(entry[1]):
+            position = bisect.bisect_left(self.terms, term)
+            while position < len(self.terms) and self.terms[position] == term:
+                if self.ids[position] == entry_id:
+                    del self.terms[position]
+                    del self.ids[position]
+                    break
+                position += 1
+
+    def load(self, items):
+        """Replaces the whole index with (entry_id, kind, label, url) items."""
+        pairs, entries = [], {}
+        for entry_id, kind, label, url in items:
+            entries[entry_id] = (kind, label, url)
+            pairs += [(term, entry_id) for term in self.terms_for(label)]
+        pairs.sort()
+        with self.lock:
+            self.entries = entries
+            self.normalized = {entry_id: normalize(entry[1]) for entry_id, entry in entries.items()}
+            self.terms = [term for term, entry_id in pairs]
+            self.ids = [entry_id for term, entry_id in pairs]
+
+    def search(self, prefix, limit=8, max_scan=500):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        whole, words, seen = [], [], set()
+        with self.lock:
+            position = bisect.bisect_left(self.terms, prefix)
+            end = min(len(self.terms), position + max_scan)
+            while position < end and self.terms[position].startswith(prefix):
+                entry_id = self.ids[position]
+                position += 1
+                if entry_id in seen:
+                    continue
+                seen.add(entry_id)
+                # matches on the start of the label rank above matches on a word
+                if self.normalized[entry_id].startswith(prefix):
+                    whole.append(entry_id)
+                    if len(whole) >= limit:
+                        break
+                else:
+                    words.append(entry_id)
+            return [self.entries[entry_id] for entry_id in (whole + words)[:limit]]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+
+## Loading the index from the database
+
+def post_entry(post):
+    return (('post', post.pk), 'post', post.title, post.get_absolute_url())
+
+
+def tag_entry(tag):
+    return (('tag', tag.pk), 'tag', tag.name, reverse('blog:post_list_by_tag', args=[tag.slug]))
+
+
+def published_tags():
+    return (Tag.objects.annotate(num_posts=Count('post', filter=Q(post__status=Post.Status.PUBLISHED)))
+                       .filter(num_posts__gt=0))
+
+
+def build_index():
+    index = PrefixIndex()
+    items = [post_entry(post) for post in Post.published_blogs.links()]
+    items += [tag_entry(tag) for tag in published_tags()]
+    index.load(items)
+    return index
+
+
+_index = None
+_index_version = None
+_build_lock = threading.Lock()
+
+
+def current_version():
+    return token_cache().get(VERSION_KEY, 0)
+
+
+def get_index():
+    """Returns this process's index, rebuilding it if another process changed it."""
+    global _index, _index_version
+    version = current_version()
+    if _index is None or _index_version != version:
+        with _build_lock:
+            if _index is None or _index_version != version:
+                _index = build_index()
+                _index_version = version
+    return _index
+
+
+def _apply(change):
+    # apply a change to the local index and tell other processes to rebuild
+    global _index, _index_version
+    if _index is not None:
+        change(_index)
+    cache = token_cache()
+    try:
+        version = cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 1, None)
+        version = cache.get(VERSION_KEY, 1)
+    if _index is None:
+        return
+    if _index_version == version - 1:
+        _index_version = version
+    else:
+        # other processes changed the index meanwhile, this one has to catch up
+        _index = None
+
+
+def invalidate():
+    global _index
+    _index = None
+    _apply(lambda index: None)
+
+
+def refresh_post(post):
+    if post.status == Post.Status.PUBLISHED:
+        _apply(lambda index: index.add(*post_entry(post)))
+    else:
+        _apply(lambda index: index.remove(('post', post.pk)))
+
+
+def remove_post(post):
+    _apply(lambda index: index.remove(('post', post.pk)))
+
+
+def refresh_tags(tag_ids):
+    tags = {tag.pk: tag for tag in published_tags().filter(pk__in=tag_ids)}
+
+    def change(index):
+        for tag_id in tag_ids:
+            if tag_id in tags:
+                index.add(*tag_entry(tags[tag_id]))
+            else:
+                index.remove(('tag', tag_id))
+    _apply(change)
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.db.backends.sqlite3 import base
+
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    Django's SQLite backend, set up for several gunicorn workers sharing one
+    database file.
+
+    Every new connection gets BLOG_SQLITE_PRAGMAS: in WAL mode readers and
+    the writer don't block each other, and busy_timeout makes a writer wait
+    for the lock instead of failing with "database is locked".
+
+    Transactions start with BEGIN IMMEDIATE, taking the write lock up front.
+    A deferred transaction that reads and then writes can't wait for the
+    lock when another worker wrote in between (SQLite fails it right away,
+    whatever the busy timeout), while one waiting at BEGIN always can.
+    """
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        for name, value in settings.BLOG_SQLITE_PRAGMAS.items():
+            connection.execute(f'PRAGMA {name} = {value}')
+        return connection
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
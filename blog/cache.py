@@ -0,0 +1,274 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+
+
+# Wrapper stored in the shared layer by get_or_compute(), so readers know
+# until when a value is fresh and after when it is only good as a stale copy
+class _Envelope:
+    __slots__ = ('value', 'fresh_until')
+
+    def __init__(self, value, fresh_until):
+        self.value = value
+        self.fresh_until = fresh_until
+
+
+def _unwrap(value):
+    if isinstance(value, _Envelope):
+        return value.value
+    return value
+
+
+
+## Two level cache: a small in-process LRU (L1) in front of a shared cache (L2)
+class TieredCache(BaseCache):
+    """
+    Cache backend combining an in-process LRU with a shared store.
+
+    LOCATION is the alias of the shared cache in settings.CACHES. Options:
+    L1_MAX_ENTRIES, L1_TIMEOUT (seconds an entry may live in L1),
+    STALE_TIMEOUT (how long an expired value may still be served while it is
+    recomputed) and LOCK_TIMEOUT (how long a recompute lock is held).
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = location or 'shared'
+        self._l1_max_entries = int(options.get('L1_MAX_ENTRIES', 1000))
+        self._l1_timeout = int(options.get('L1_TIMEOUT', 30))
+        self._stale_timeout = int(options.get('STALE_TIMEOUT', 60))
+        self._lock_timeout = int(options.get('LOCK_TIMEOUT', 10))
+        self._l1 = OrderedDict()
+        self._l1_lock = threading.Lock()
+        self._stats = defaultdict(lambda: {'l1_hits': 0, 'l2_hits': 0, 'misses': 0, 'stale': 0})
+        self._stats_lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+
+    # --- L1 helpers -------------------------------------------------------
+
+    def _l1_get(self, key):
+        with self._l1_lock:
+            entry = self._l1.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._l1[key]
+                return None
+            self._l1.move_to_end(key)
+            return entry
+
+    def _l1_set(self, key, value, timeout):
+        ttl = self._l1_timeout if timeout is None else min(self._l1_timeout, timeout)
+        if ttl <= 0:
+            self._l1_delete(key)
+            return
+        with self._l1_lock:
+            self._l1[key] = (value, time.monotonic() + ttl)
+            self._l1.move_to_end(key)
+            while len(self._l1) > self._l1_max_entries:
+                self._l1.popitem(last=False)
+
+    def _l1_delete(self, key):
+        with self._l1_lock:
+            self._l1.pop(key, None)
+
+    def _timeout(self, timeout):
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+
+    # --- hit ratio bookkeeping --------------------------------------------
+
+    def _record(self, key, outcome):
+        prefix = str(key).split(':', 1)[0]
+        with self._stats_lock:
+            self._stats[prefix][outcome] += 1
+
+    def stats(self):
+        """Returns hit counters and the hit ratio for each key prefix."""
+        with self._stats_lock:
+            result = {}
+            for prefix, counters in self._stats.items():
+                lookups = counters['l1_hits'] + counters['l2_hits'] + counters['misses']
+                hits = counters['l1_hits'] + counters['l2_hits']
+                result[prefix] = dict(counters, hit_ratio=hits / lookups if lookups else 0.0)
+            return result
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._stats.clear()
+
+
+    # --- BaseCache API ----------------------------------------------------
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        entry = self._l1_get(local_key)
+        if entry is not None:
+            self._record(key, 'l1_hits')
+            return _unwrap(entry[0])
+
+        sentinel = object()
+        value = self.shared.get(key, sentinel, version=version)
+        if value is sentinel:
+            self._record(key, 'misses')
+            return default
+        self._record(key, 'l2_hits')
+        self._l1_set(local_key, value, self._l1_timeout)
+        return _unwrap(value)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self._timeout(timeout)
+        self.shared.set(key, value, timeout, version=version)
+        self._l1_set(self.make_and_validate_key(key, version=version), value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self._timeout(timeout)
+        added = self.shared.add(key, value, timeout, version=version)
+        if added:
+            self._l1_set(self.make_and_validate_key(key, version=version), value, timeout)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self._l1_delete(self.make_and_validate_key(key, version=version))
+        return self.shared.touch(key, self._timeout(timeout), version=version)
+
+    def delete(self, key, version=None):
+        self._l1_delete(self.make_and_validate_key(key, version=version))
+        return self.shared.delete(key, version=version)
+
+    def has_key(self, key, version=None):
+        if self._l1_get(self.make_and_validate_key(key, version=version)) is not None:
+            return True
+        return self.shared.has_key(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        # Counters must be coordinated between workers, so they always go to
+        # the shared layer (atomic on Redis) and are never kept in L1
+        self._l1_delete(self.make_and_validate_key(key, version=version))
+        return self.shared.incr(key, delta, version=version)
+
+    def clear(self):
+        with self._l1_lock:
+            self._l1.clear()
+        self.shared.clear()
+
+    def clear_local(self):
+        with self._l1_lock:
+            self._l1.clear()
+
+
+    # --- single flight recomputation --------------------------------------
+
+    def get_or_compute(self, key, compute, timeout=DEFAULT_TIMEOUT, version=None):
+        """
+        Returns the cached value for key, calling compute() to build it.
+
+        Only the worker holding the recompute lock calls compute(); others
+        serve the stale copy while it is rebuilt, or wait briefly for the
+        new value when there is no stale copy at all.
+        """
+        timeout = self._timeout(timeout)
+        local_key = self.make_and_validate_key(key, version=version)
+        now = time.time()
+
+        entry = self._l1_get(local_key)
+        if entry is not None and isinstance(entry[0], _Envelope) and entry[0].fresh_until > now:
+            self._record(key, 'l1_hits')
+            return entry[0].value
+
+        envelope = self.shared.get(key, version=version)
+        if not isinstance(envelope, _Envelope):
+            envelope = None
+        if envelope is not None and envelope.fresh_until > now:
+            self._record(key, 'l2_hits')
+            self._l1_set(local_key, envelope, envelope.fresh_until - now)
+            return envelope.value
+
+        lock_key = f'{key}:lock'
+        if self.shared.add(lock_key, 1, self._lock_timeout, version=version):
+            try:
+                self._record(key, 'misses')
+                value = compute()
+                self._store(key, local_key, value, timeout, version)
+                return value
+            finally:
+                self.shared.delete(lock_key, version=version)
+
+        if envelope is not None:
+            # Someone else is rebuilding it, serve the stale copy meanwhile
+            self._record(key, 'stale')
+            return envelope.value
+
+        # Cold key being built by another worker: wait for it, but never
+        # longer than the lock itself could be held
+        deadline = time.monotonic() + self._lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            envelope = self.shared.get(key, version=version)
+            if isinstance(envelope, _Envelope):
+                self._record(key, 'l2_hits')
+                return envelope.value
+
+        self._record(key, 'misses')
+        value = compute()
+        self._store(key, local_key, value, timeout, version)
+        return value
+
+    def _store(self, key, local_key, value, timeout, version):
+        if timeout is None:
+            fresh_until, shared_timeout = float('inf'), None
+        else:
+            fresh_until, shared_timeout = time.time() + timeout, timeout + self._stale_timeout
+        envelope = _Envelope(value, fresh_until)
+        self.shared.set(key, envelope, shared_timeout, version=version)
+        self._l1_set(local_key, envelope, timeout)
+
+
+
+## Helpers used by the blog to cache values without caring about the backend
+def cached(key, compute, timeout=DEFAULT_TIMEOUT, alias='default'):
+    cache = caches[alias]
+    if hasattr(cache, 'get_or_compute'):
+        return cache.get_or_compute(key, compute, timeout)
+    return cache.get_or_set(key, compute, timeout)
+
+
+# Invalidation tokens, like the content version below, have to be seen by
+# every worker as soon as they change, so they skip TieredCache's L1 and are
+# read and written in the shared layer
+def token_cache(alias='default'):
+    cache = caches[alias]
+    return getattr(cache, 'shared', cache)
+
+
+# Every cached fragment derived from posts, comments or tags embeds this
+# version in its key, so bumping it invalidates all of them at once
+CONTENT_VERSION_KEY = 'blog:content-version'
+
+
+def content_version():
+    cache = token_cache()
+    version = cache.get(CONTENT_VERSION_KEY)
+    if version is None:
+        cache.add(CONTENT_VERSION_KEY, 1, None)
+        version = cache.get(CONTENT_VERSION_KEY, 1)
+    return version
+
+
+def bump_content_version():
+    cache = token_cache()
+    try:
+        return cache.incr(CONTENT_VERSION_KEY)
+    except ValueError:
+        cache.add(CONTENT_VERSION_KEY, 2, None)
+        return cache.get(CONTENT_VERSION_KEY, 2)
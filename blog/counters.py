@@ -0,0 +1,82 @@
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+from . import trending
+from .models import PostStats
+
+
+logger = logging.getLogger(__name__)
+
+
+
+## Writes buffered view counts to PostStats, and to the trending scores
+def flush_counts(counts):
+    with transaction.atomic():
+        PostStats.objects.increment('views', counts)
+        trending.record_activity(counts, 'view')
+
+
+
+## Per process buffer of page views
+class ViewCounter:
+    """
+    Counts views in memory and flushes them every BLOG_VIEW_FLUSH_INTERVAL
+    seconds, or sooner once BLOG_VIEW_BUFFER_SIZE posts are buffered. The
+    flush runs on the request that finds it due and again when the process
+    exits, so a crashed worker loses at most one interval of views.
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        self.last_flush = time.monotonic()
+
+    def record(self, post_id):
+        with self.lock:
+            self.counts[post_id] += 1
+            due = (time.monotonic() - self.last_flush >= settings.BLOG_VIEW_FLUSH_INTERVAL
+                   or len(self.counts) >= settings.BLOG_VIEW_BUFFER_SIZE)
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered counts, returns how many views were written."""
+        with self.lock:
+            counts, self.counts = self.counts, Counter()
+            self.last_flush = time.monotonic()
+        if not counts:
+            return 0
+        try:
+            flush_counts(counts)
+        except DatabaseError:
+            # keep the views for the next flush rather than dropping them
+            logger.exception('Flushing %d post view counters failed', len(counts))
+            with self.lock:
+                self.counts.update(counts)
+            return 0
+        return sum(counts.values())
+
+    def pending(self):
+        with self.lock:
+            return dict(self.counts)
+
+
+view_counter = ViewCounter()
+
+
+def record_view(post_id):
+    view_counter.record(post_id)
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        view_counter.flush()
+    except Exception:
+        pass
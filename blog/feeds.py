@@ -1,8 +1,8 @@
-import markdown
 from django.contrib.syndication.views import Feed
 from django.template.defaultfilters import truncatewords_html
 from django.urls import reverse_lazy
 from .models import Post
+from .rendering import render_markdown
 
 
 
@@ -13,13 +13,13 @@ class LatestPostsFeed(Feed):
 
 
     def items(self):
-        return Post.published_blogs.all()[:5]
+        return Post.published_blogs.feed_items()[:5]
     
     def item_title(self, item):
         return item.title
     
     def item_description(self, item):
-        return truncatewords_html(markdown.markdown(item.body), 30)
+        return truncatewords_html(render_markdown(item.body), 30)
     
     def item_publication_date(self, item):
         return item.published
\ No newline at end of file
@@ -0,0 +1,51 @@
+import re
+from pathlib import Path
+
+from django.template.loaders.app_directories import Loader as AppDirectoriesLoader
+
+
+# Only the blog's own html templates are minified, the admin and other apps
+# are served as they ship
+TEMPLATE_DIR = str(Path(__file__).resolve().parent / 'templates')
+
+# Content whose whitespace matters is passed through untouched
+PRESERVED_RE = re.compile(
+    r'(<(pre|textarea|script|style)\b.*?</\2\s*>'
+    r'|{%\s*verbatim\s*%}.*?{%\s*endverbatim\s*%})',
+    re.DOTALL | re.IGNORECASE,
+)
+# html comments, including IE conditional comments
+COMMENT_RE = re.compile(r'<!--.*?-->', re.DOTALL)
+# runs of whitespace that span lines, such as indentation
+WHITESPACE_RE = re.compile(r'\s*\n\s*')
+
+
+
+def minify(source):
+    """
+    Strips html comments and folds multi line whitespace into one space.
+
+    Whitespace that stays on one line is kept, as browsers show it as a single
+    space anyway, which keeps the text between inline tags and template tags
+    looking the same.
+    """
+    parts = PRESERVED_RE.split(source)
+    # split() returns text, preserved block, tag name, text, ...
+    minified = []
+    for i in range(0, len(parts), 3):
+        text = COMMENT_RE.sub('', parts[i])
+        minified.append(WHITESPACE_RE.sub(' ', text))
+        if i + 1 < len(parts):
+            minified.append(parts[i + 1])
+    return ''.join(minified)
+
+
+
+## Template loader, meant to be wrapped in the cached loader so a template
+## is minified once, when it is compiled, rather than on every render
+class MinifyingLoader(AppDirectoriesLoader):
+    def get_contents(self, origin):
+        contents = super().get_contents(origin)
+        if origin.name.startswith(TEMPLATE_DIR) and origin.name.endswith('.html'):
+            contents = minify(contents)
+        return contents
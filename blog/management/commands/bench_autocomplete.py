@@ -0,0 +1,66 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+
+from blog.autocomplete import get_index
+from blog.warmup import internal_client
+
+
+QUERIES = ['na', 'nat', 'natu', 'fo', 'for', 'fores', 'ri', 'riv', 'mo', 'mou', 'oc', 'se', 'tr', 'wa', 'bi', 'xz']
+
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+class Command(BaseCommand):
+    help = 'Measures latency of the search-as-you-type endpoint under concurrent load.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=8)
+
+    def report(self, label, samples, elapsed):
+        ms = [sample * 1000 for sample in samples]
+        self.stdout.write(
+            f'{label:<10} {len(ms)} requests in {elapsed:.2f}s ({len(ms) / elapsed:.0f}/s)  '
+            f'p50 {statistics.median(ms):.3f}ms  p95 {percentile(ms, 95):.3f}ms  p99 {percentile(ms, 99):.3f}ms'
+        )
+
+    def run(self, work, requests, concurrency):
+        def timed(n):
+            started = time.perf_counter()
+            work(QUERIES[n % len(QUERIES)])
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = list(pool.map(timed, range(requests)))
+        return samples, time.perf_counter() - started
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        index = get_index()
+        self.stdout.write(f'index of {len(index)} entries built in {(time.perf_counter() - started) * 1000:.1f}ms')
+
+        samples, elapsed = self.run(index.search, options['requests'], options['concurrency'])
+        self.report('index', samples, elapsed)
+
+        url = reverse('blog:post_suggest')
+        local = threading.local()
+
+        def request(query):
+            # one client per thread, they are not thread safe
+            if not hasattr(local, 'client'):
+                local.client = internal_client()
+            response = local.client.get(url, {'q': query})
+            assert response.status_code == 200
+
+        samples, elapsed = self.run(request, options['requests'], options['concurrency'])
+        self.report('endpoint', samples, elapsed)
@@ -0,0 +1,66 @@
+import difflib
+import html
+import re
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.models import Post
+from blog.rendering import build_renderer
+
+
+BACKENDS = ['blog.rendering.PythonMarkdownBackend', 'blog.rendering.MarkdownItBackend']
+
+TAG_RE = re.compile(r'\s*(<[^>]+>)\s*')
+
+
+
+def normalize(text):
+    # entities and whitespace around tags differ between backends without changing the page
+    return TAG_RE.sub(r'\1', html.unescape(text)).strip()
+
+
+class Command(BaseCommand):
+    help = ('Renders the bodies of all posts with each markdown backend, reporting throughput '
+            'and which posts come out differently from the first backend.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', action='append', dest='backends',
+                            help='Dotted path of a backend, may be repeated. Defaults to all of them.')
+        parser.add_argument('--sanitizer', help='Dotted path of a sanitizer to apply as well.')
+        parser.add_argument('--repeat', type=int, default=5, help='Times the corpus is rendered.')
+        parser.add_argument('--show-diffs', type=int, default=3, help='Number of differing posts to print a diff of.')
+
+    def handle(self, *args, **options):
+        corpus = list(Post.objects.order_by('id').values_list('id', 'title', 'body'))
+        if not corpus:
+            raise CommandError('There are no posts to render')
+        size = sum(len(body.encode()) for post_id, title, body in corpus)
+        self.stdout.write(f'{len(corpus)} posts, {size / 1024:.0f} KiB of markdown')
+
+        outputs = {}
+        for path in options['backends'] or BACKENDS:
+            try:
+                renderer = build_renderer(path, options['sanitizer'])
+            except ImportError as exc:
+                self.stdout.write(f'{path}: not installed ({exc})')
+                continue
+
+            started = time.perf_counter()
+            for _ in range(options['repeat']):
+                rendered = [renderer.render(body) for post_id, title, body in corpus]
+            elapsed = (time.perf_counter() - started) / options['repeat']
+            outputs[renderer.name] = rendered
+            self.stdout.write(f'{renderer.name:<24} {elapsed * 1000:8.1f}ms per pass  '
+                              f'{len(corpus) / elapsed:8.0f} posts/s  {size / elapsed / 2 ** 20:6.2f} MiB/s')
+
+        if len(outputs) < 2:
+            return
+        (reference, expected), *others = outputs.items()
+        for name, rendered in others:
+            differing = [(post, a, b) for post, a, b in zip(corpus, expected, rendered) if normalize(a) != normalize(b)]
+            self.stdout.write(f'{name}: {len(differing)} of {len(corpus)} posts differ from {reference}')
+            for (post_id, title, body), a, b in differing[:options['show_diffs']]:
+                self.stdout.write(f'--- post {post_id}: {title}')
+                diff = difflib.unified_diff(a.splitlines(), b.splitlines(), reference, name, lineterm='', n=1)
+                self.stdout.write('\n'.join(list(diff)[:40]))
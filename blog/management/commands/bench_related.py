@@ -0,0 +1,65 @@
+import random
+import string
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from blog.related import TfidfModel, nearest
+
+
+
+def word(n):
+    # letters only, the tokenizer skips digits
+    letters = ''
+    while True:
+        n, digit = divmod(n, 26)
+        letters += string.ascii_lowercase[digit]
+        if not n:
+            return 'w' + letters.ljust(3, 'x')
+
+
+def synthetic_posts(count, vocabulary_size, words_per_post, seed=0):
+    # Zipf-like word frequencies, with each post leaning towards a few topics
+    # so that the neighbours are not all noise
+    rng = random.Random(seed)
+    words = [word(n) for n in range(vocabulary_size)]
+    weights = [1 / (rank + 1) for rank in range(vocabulary_size)]
+    topics = [rng.sample(words, 50) for _ in range(200)]
+    for post_id in range(count):
+        topic = topics[post_id % len(topics)]
+        body = rng.choices(words, weights, k=words_per_post) + rng.choices(topic, k=words_per_post // 4)
+        yield post_id, ' '.join(rng.sample(topic, 3)), ' '.join(body)
+
+
+class Command(BaseCommand):
+    help = 'Measures how long computing related posts takes on a synthetic corpus, without touching the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=100000)
+        parser.add_argument('--vocabulary', type=int, default=50000)
+        parser.add_argument('--words', type=int, default=400, help='Words per post.')
+        parser.add_argument('--neighbours', type=int, default=settings.BLOG_RELATED_NEIGHBOURS)
+        parser.add_argument('--batch-size', type=int, default=settings.BLOG_RELATED_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        posts = list(synthetic_posts(options['posts'], options['vocabulary'], options['words']))
+
+        started = time.perf_counter()
+        model = TfidfModel.fit(posts)
+        fitted = time.perf_counter()
+        self.stdout.write(f'fit       {len(model.ids)} posts, {len(model.terms)} terms, '
+                          f'{model.matrix.nnz} non zeros in {fitted - started:.1f}s')
+
+        pairs = 0
+        for results in nearest(model.matrix, range(len(model.ids)), options['neighbours'], options['batch_size']):
+            pairs += sum(len(neighbours) for row, neighbours, scores in results)
+        done = time.perf_counter()
+        self.stdout.write(f'neighbours {pairs} pairs in {done - fitted:.1f}s '
+                          f'({len(model.ids) / (done - fitted):.0f} posts/s)')
+
+        started = time.perf_counter()
+        post_id, title, body = posts[0]
+        model.set_row(post_id, model.transform(title, body))
+        list(nearest(model.matrix, [model.rows[post_id]], options['neighbours'], 1))
+        self.stdout.write(f'update    one post in {(time.perf_counter() - started) * 1000:.0f}ms')
@@ -0,0 +1,96 @@
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections, transaction
+from django.db.models import Count
+from django.db.utils import load_backend
+
+from blog.models import Comment, Post
+
+
+# (name, engine, journal mode): Django's own backend as the project used it,
+# and blog.backends.sqlite3 with BLOG_SQLITE_PRAGMAS
+SETUPS = [
+    ('stock', 'django.db.backends.sqlite3', 'delete'),
+    ('tuned', 'blog.backends.sqlite3', 'wal'),
+]
+
+
+
+def copy_database(source, target, journal_mode):
+    # the backup API gives a consistent copy even while the database is in use
+    with sqlite3.connect(source) as src, sqlite3.connect(target) as dst:
+        src.backup(dst)
+        dst.execute(f'PRAGMA journal_mode = {journal_mode}')
+    src.close()
+    dst.close()
+
+
+def run_worker(engine, path, post_ids, seconds, write_share, seed):
+    """Runs the mix in a forked process, returns (reads, writes, locked errors)."""
+    settings_dict = {**connections['default'].settings_dict, 'ENGINE': engine, 'NAME': path}
+    connections['default'] = load_backend(engine).DatabaseWrapper(settings_dict, 'default')
+
+    rng = random.Random(seed)
+    reads = writes = locked = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        post_id = rng.choice(post_ids)
+        try:
+            if rng.random() < write_share:
+                # a comment, with the trending score update its signal makes
+                with transaction.atomic():
+                    Comment.objects.create(post_id=post_id, name='Bench', email='bench@example.com', body='Lovely')
+                writes += 1
+            else:
+                list(Post.published_blogs.annotate(num_comments=Count('comments')).order_by('-published')[:6])
+                list(Comment.objects.thread(post_id)[:20])
+                reads += 1
+        except OperationalError as exc:
+            if 'locked' not in str(exc):
+                raise
+            locked += 1
+    connections['default'].close()
+    return reads, writes, locked
+
+
+class Command(BaseCommand):
+    help = ('Measures mixed read/write throughput on copies of the SQLite database, with Django\'s '
+            'stock SQLite setup and with blog.backends.sqlite3, for several numbers of worker processes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', default='1,2,4', help='Comma separated numbers of worker processes.')
+        parser.add_argument('--seconds', type=float, default=5, help='Length of each run.')
+        parser.add_argument('--writes', type=float, default=0.1, help='Share of operations that write.')
+
+    def handle(self, *args, **options):
+        connection = connections['default']
+        if connection.vendor != 'sqlite':
+            raise CommandError(f'The default database is {connection.vendor}, not SQLite')
+        post_ids = list(Post.published_blogs.values_list('id', flat=True))
+        if not post_ids:
+            raise CommandError('There are no published posts to read and comment on')
+        source = str(connection.settings_dict['NAME'])
+        workers = [int(n) for n in options['workers'].split(',')]
+
+        self.stdout.write(f'{"setup":<6} {"workers":>7} {"reads/s":>9} {"writes/s":>9} {"locked":>7}')
+        context = multiprocessing.get_context('fork')
+        for name, engine, journal_mode in SETUPS:
+            for count in workers:
+                with tempfile.TemporaryDirectory() as directory:
+                    path = os.path.join(directory, 'bench.sqlite3')
+                    copy_database(source, path, journal_mode)
+                    # forked workers must not share the parent's connections
+                    connections.close_all()
+                    with context.Pool(count) as pool:
+                        results = pool.starmap(run_worker, [
+                            (engine, path, post_ids, options['seconds'], options['writes'], seed)
+                            for seed in range(count)])
+                reads, writes, locked = (sum(column) for column in zip(*results))
+                self.stdout.write(f'{name:<6} {count:>7} {reads / options["seconds"]:>9.0f} '
+                                  f'{writes / options["seconds"]:>9.0f} {locked:>7}')
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.models import Post
+from blog.related import build_all, update_post
+
+
+
+class Command(BaseCommand):
+    help = ('Recomputes the related posts of every published post from their text. '
+            'Run it nightly, the publish pipeline only updates the posts it touches.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--post', type=int, help='Only update the given post and its neighbours.')
+
+    def handle(self, *args, **options):
+        if options['post']:
+            try:
+                post = Post.objects.get(pk=options['post'])
+            except Post.DoesNotExist:
+                raise CommandError(f'No post with id {options["post"]}')
+            update_post(post)
+            self.stdout.write(f'Related posts of {post} updated')
+            return
+
+        model = build_all()
+        self.stdout.write(f'Related posts of {len(model.ids)} posts computed from {len(model.terms)} terms')
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.snapshot import take_snapshot
+
+
+
+class Command(BaseCommand):
+    help = ('Renders every public page of the blog to static files that WhiteNoise '
+            'can serve directly (see BLOG_SNAPSHOT_ROOT in settings).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.BLOG_SNAPSHOT_ROOT,
+                            help='Directory to write the snapshot to.')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only re-render pages affected by posts and comments '
+                                 'updated, published or retagged since the last snapshot. '
+                                 'Pages the site no longer has are removed either way.')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Number of rendering processes, defaults to the CPU count.')
+
+    def handle(self, *args, **options):
+        if not options['output']:
+            raise CommandError('No output directory, pass --output or set BLOG_SNAPSHOT_ROOT.')
+
+        written, failed = take_snapshot(options['output'], options['incremental'], options['workers'])
+        for path in failed:
+            self.stderr.write(f'Could not render {path}')
+        self.stdout.write(f'{written} pages written to {options["output"]}')
+        if failed:
+            raise CommandError(f'{len(failed)} pages failed, the snapshot was not marked complete.')
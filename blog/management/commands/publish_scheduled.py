@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from blog.publishing import enqueue_due_posts, run_pending_jobs
+
+
+
+class Command(BaseCommand):
+    help = ('Publishes scheduled posts whose publish time has come and precomputes '
+            'everything they need. Run it every few minutes, e.g. with Heroku Scheduler.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of posts queued or processed per batch.')
+
+    def handle(self, *args, **options):
+        queued = enqueue_due_posts(batch_size=options['batch_size'])
+        done, failed = run_pending_jobs(limit=options['batch_size'])
+        self.stdout.write(f'{queued} posts queued, {done} jobs done, {failed} jobs to retry')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from blog.trending import renormalize
+
+
+
+class Command(BaseCommand):
+    help = ('Moves the trending epoch to now and scales the scores down to match, '
+            'dropping posts whose activity has decayed away. Run it daily.')
+
+    def handle(self, *args, **options):
+        removed = renormalize()
+        self.stdout.write(f'Trending scores renormalized, {removed} decayed scores removed')
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+
+class Command(BaseCommand):
+    help = ('Checkpoints the write-ahead log back into an SQLite database and lets SQLite refresh '
+            'its query planner statistics. Run it daily, e.g. with Heroku Scheduler or cron.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='Database alias.')
+        parser.add_argument('--vacuum', action='store_true',
+                            help='Also rebuild the file to reclaim free pages. Blocks writers while it runs.')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'sqlite':
+            raise CommandError(f'{options["database"]} is a {connection.vendor} database, not SQLite')
+
+        with connection.cursor() as cursor:
+            # TRUNCATE waits for readers of the old log and empties it, so it doesn't keep growing
+            cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            busy, log_pages, checkpointed = cursor.fetchone()
+            if busy:
+                self.stdout.write(self.style.WARNING('Checkpoint was blocked by a busy connection, try again later'))
+            else:
+                self.stdout.write(f'Checkpointed {checkpointed} of {log_pages} pages of the write-ahead log')
+
+            # analyzes the tables whose statistics are out of date, a no-op otherwise
+            cursor.execute('PRAGMA optimize')
+            self.stdout.write('Optimized')
+
+            if options['vacuum']:
+                cursor.execute('PRAGMA freelist_count')
+                free = cursor.fetchone()[0]
+                cursor.execute('VACUUM')
+                self.stdout.write(f'Vacuumed, {free} free pages reclaimed')
@@ -0,0 +1,89 @@
+import json
+import re
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+# Run in a fresh interpreter, as a dyno's worker would start: loads the WSGI
+# app, optionally warms it up, then times two requests for the same page.
+CHILD = '''
+import json, sys, time
+started = time.perf_counter()
+from django.utils.module_loading import import_string
+import_string(sys.argv[1])
+result = {"load": time.perf_counter() - started, "warm_up": []}
+
+if sys.argv[3] == "warm":
+    from blog.startup import connect_databases, warm_up
+    result["warm_up"] = [[step, seconds] for step, loaded, seconds in warm_up()]
+    connect_databases()
+
+from blog.warmup import internal_client
+client = internal_client()
+result["requests"] = []
+for _ in range(2):
+    started = time.perf_counter()
+    response = client.get(sys.argv[2])
+    b"".join(response.streaming_content) if response.streaming else response.content
+    result["requests"].append([response.status_code, time.perf_counter() - started])
+print(json.dumps(result))
+'''
+
+IMPORT_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+
+def top_imports(stderr, count):
+    """The count slowest top level imports as (module, self seconds, cumulative seconds)."""
+    imports = []
+    for line in stderr.splitlines():
+        match = IMPORT_RE.match(line)
+        if match and len(match[3]) == 1:
+            imports.append((match[4], int(match[1]) / 1e6, int(match[2]) / 1e6))
+    return sorted(imports, key=lambda item: -item[2])[:count]
+
+
+class Command(BaseCommand):
+    help = ('Starts the app in a fresh process and reports the slowest imports, the warm up steps '
+            'and how long the first request takes, against BLOG_FIRST_REQUEST_TARGET.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/blog/', help='Page requested after startup.')
+        parser.add_argument('--cold', action='store_true', help='Skip the warm up, as a worker without it would.')
+        parser.add_argument('--imports', type=int, default=15, help='Number of slowest imports to list.')
+        parser.add_argument('--check', action='store_true',
+                            help='Fail when the first request is slower than the target.')
+
+    def handle(self, *args, **options):
+        child = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', CHILD,
+             settings.WSGI_APPLICATION, options['path'], 'cold' if options['cold'] else 'warm'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True,
+        )
+        if child.returncode:
+            raise CommandError(f'Starting the app failed:\n{child.stderr[-2000:]}')
+        result = json.loads(child.stdout.strip().splitlines()[-1])
+
+        self.stdout.write('Slowest imports (self / cumulative):')
+        for module, own, cumulative in top_imports(child.stderr, options['imports']):
+            self.stdout.write(f'  {module:<40} {own * 1000:7.1f}ms {cumulative * 1000:8.1f}ms')
+        self.stdout.write(f'Loading the app: {result["load"] * 1000:.0f}ms')
+        for step, seconds in result['warm_up']:
+            self.stdout.write(f'Warm up {step:<20} {seconds * 1000:7.1f}ms')
+
+        (status, first), (_, second) = result['requests']
+        target = settings.BLOG_FIRST_REQUEST_TARGET
+        self.stdout.write(f'GET {options["path"]}: {status}, first request {first * 1000:.0f}ms, '
+                          f'second {second * 1000:.0f}ms, target {target * 1000:.0f}ms')
+        if status != 200:
+            raise CommandError(f'{options["path"]} returned {status}')
+        if first > target:
+            message = f'The first request took {first * 1000:.0f}ms, over the {target * 1000:.0f}ms target'
+            if options['check']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS('The first request is within the target'))
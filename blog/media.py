@@ -0,0 +1,182 @@
+import hashlib
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+
+# Uploads kept on local disk (without Cloudinary) and the view serving them.
+# The file itself is sent by the WSGI server with sendfile() (gunicorn does
+# this for FileResponse), or by the proxy in front when BLOG_MEDIA_SENDFILE
+# is set, so a worker is never busy copying a large gallery image.
+
+# names with a digest of the content, as HashedMediaStorage saves them
+HASHED_NAME_RE = re.compile(r'\.[0-9a-f]{12}\.\w+$')
+
+DIGEST_LENGTH = 12
+
+# a year, as long as caches keep anything anyway
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+
+## Storage
+class HashedMediaStorage(FileSystemStorage):
+    """
+    FileSystemStorage that puts a digest of the content in the file name,
+    e.g. images/heron.3f2a9c0d81b4.jpg. The file behind a name never changes,
+    so it can be cached for good, and uploading the same file twice stores
+    it once.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+
+        root, ext = os.path.splitext(name)
+        name = f'{root}.{digest.hexdigest()[:DIGEST_LENGTH]}{ext}'
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
+
+
+
+## Byte ranges
+class FileRange:
+    """
+    Part of an open file, for FileResponse. It has the file's descriptor,
+    already at the start of the range, so the server can sendfile() the
+    Content-Length bytes from there; reading it yields only the range.
+    """
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """
+    The (start, length) of a single "bytes=" range, None when the whole file
+    should be sent instead (no range, several ranges or one we don't know),
+    raises ValueError when the range is outside the file.
+    """
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match or match[1] == match[2] == '':
+        return None
+    if match[1] == '':
+        # the last n bytes
+        length = min(int(match[2]), size)
+        if length == 0:
+            raise ValueError(header)
+        return size - length, length
+    start = int(match[1])
+    end = min(int(match[2]), size - 1) if match[2] else size - 1
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, end - start + 1
+
+
+
+## View
+def file_etag(stat):
+    # the size and modification time change whenever the content does
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def add_caching_headers(response, path, etag, modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(modified)
+    if HASHED_NAME_RE.search(path):
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=settings.BLOG_MEDIA_MAX_AGE)
+    return response
+
+
+def sendfile_response(path, full_path, content_type):
+    """Leaves sending the file to the proxy, which handles ranges itself."""
+    response = HttpResponse(content_type=content_type)
+    if settings.BLOG_MEDIA_SENDFILE == 'x-accel-redirect':
+        # nginx: an internal location aliased to MEDIA_ROOT
+        response['X-Accel-Redirect'] = settings.BLOG_MEDIA_ACCEL_PREFIX + quote(path)
+    else:
+        # Apache mod_xsendfile, lighttpd, Caddy
+        response['X-Sendfile'] = full_path
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    """Serves an uploaded file from MEDIA_ROOT."""
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404('No such file')
+    if not os.path.isfile(full_path):
+        raise Http404('No such file')
+
+    etag = file_etag(stat)
+    modified = stat.st_mtime
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(modified))
+    if not_modified is not None:
+        return add_caching_headers(not_modified, path, etag, modified)
+
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    if settings.BLOG_MEDIA_SENDFILE:
+        return add_caching_headers(sendfile_response(path, full_path, content_type), path, etag, modified)
+
+    size = stat.st_size
+    part = None
+    # If-Range: only send the range if the client's copy is still the current file
+    if 'Range' in request.headers and request.headers.get('If-Range', etag) == etag:
+        try:
+            part = parse_range(request.headers['Range'], size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    file = open(full_path, 'rb')
+    if part is None:
+        response = FileResponse(file, content_type=content_type)
+    else:
+        start, length = part
+        response = FileResponse(FileRange(file, start, length), content_type=content_type, status=206)
+        response['Content-Length'] = length
+        response['Content-Range'] = f'bytes {start}-{start + length - 1}/{size}'
+    response['Accept-Ranges'] = 'bytes'
+    return add_caching_headers(response, path, etag, modified)
@@ -0,0 +1,114 @@
+import re
+
+from django.conf import settings
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_cache_control, patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, without it responses are gzipped
+    brotli = None
+
+
+# Brotli levels above 5 cost far more time than they save bytes on pages
+# compressed on every request
+BROTLI_QUALITY = 5
+
+ACCEPTS_BROTLI_RE = re.compile(r'\bbr\b')
+
+# images and other media are compressed already
+COMPRESSIBLE_RE = re.compile(r'^(text/|application/(json|javascript|xml|rss\+xml|atom\+xml)|image/svg\+xml)')
+
+
+
+## Session middleware with a fast path for anonymous readers
+class AnonymousFastPathMiddleware(SessionMiddleware):
+    """
+    Drop-in replacement for SessionMiddleware.
+
+    Read-only requests to the public blog pages that carry no session cookie
+    get an empty session that is never saved, so no session is loaded, no
+    "Vary: Cookie" is added and the response can be cached by shared caches.
+    Everything else goes through the regular session handling.
+    """
+
+    def is_fast_path(self, request):
+        return (
+            request.method in ('GET', 'HEAD')
+            and settings.SESSION_COOKIE_NAME not in request.COOKIES
+            and request.path_info.startswith(tuple(settings.BLOG_FAST_PATH_PREFIXES))
+        )
+
+    def process_request(self, request):
+        request.blog_fast_path = self.is_fast_path(request)
+        if request.blog_fast_path:
+            request.session = self.SessionStore()
+        else:
+            super().process_request(request)
+
+    def process_response(self, request, response):
+        if not getattr(request, 'blog_fast_path', False) or request.session.modified:
+            # something stored data in the session, keep it the normal way
+            return super().process_response(request, response)
+
+        if response.status_code == 200 and not response.cookies and not response.has_header('Cache-Control'):
+            patch_cache_control(response, public=True, max_age=settings.BLOG_PUBLIC_MAX_AGE)
+        return response
+
+
+
+## Response compression
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Drop-in replacement for GZipMiddleware that sends brotli to clients
+    accepting it, when the brotli package is installed. Streamed responses
+    are compressed a chunk at a time, so they are still sent as they render.
+
+    Pages carrying a CSRF token stay on gzip, whose random padding makes
+    guessing the token from the compressed size (BREACH) impractical.
+    """
+
+    def process_response(self, request, response):
+        if not COMPRESSIBLE_RE.match(response.get('Content-Type', '')) or response.has_header('Content-Range'):
+            return response
+        if not self.use_brotli(request, response):
+            return super().process_response(request, response)
+
+        if not response.streaming and len(response.content) < 200:
+            return response
+        if response.has_header('Content-Encoding'):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        if response.streaming:
+            response.streaming_content = brotli_sequence(response.streaming_content)
+            del response.headers['Content-Length']
+        else:
+            compressed = brotli.compress(response.content, quality=BROTLI_QUALITY)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        return response
+
+    def use_brotli(self, request, response):
+        return (brotli is not None
+                and ACCEPTS_BROTLI_RE.search(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+                # the CSRF cookie is (re)set whenever the page used the token
+                and settings.CSRF_COOKIE_NAME not in response.cookies
+                and not getattr(response, 'is_async', False))
+
+
+def brotli_sequence(sequence):
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    for chunk in sequence:
+        data = compressor.process(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
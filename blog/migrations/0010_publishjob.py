@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-19 15:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0009_contactmessage_alter_post_image'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='status',
+            field=models.CharField(choices=[('DF', 'Draft'), ('SC', 'Scheduled'), ('PD', 'published')], default='DF', max_length=2),
+        ),
+        migrations.CreateModel(
+            name='PublishJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stage', models.PositiveSmallIntegerField(default=0)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('state', models.CharField(choices=[('PE', 'Pending'), ('DO', 'Done'), ('FA', 'Failed')], default='PE', max_length=2)),
+                ('last_error', models.TextField(blank=True)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='publish_job', to='blog.post')),
+            ],
+            options={
+                'ordering': ['run_after'],
+                'indexes': [models.Index(fields=['state', 'run_after'], name='blog_publis_state_bd2c0d_idx')],
+            },
+        ),
+    ]
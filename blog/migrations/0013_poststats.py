@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-19 15:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0012_comment_thread_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostStats',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='blog.post')),
+                ('views', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'post stats',
+                'indexes': [models.Index(fields=['-views'], name='blog_postst_views_2d018a_idx')],
+            },
+        ),
+    ]
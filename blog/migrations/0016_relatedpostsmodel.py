@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-19 16:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0015_relatedpost'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedPostsModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.BinaryField()),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -1,4 +1,6 @@
 from django.db import models
+from django.db import connections, transaction
+from django.db.models import F, Q
 from django.db.models.query import QuerySet
 from django.utils import timezone
 from django.contrib.auth.models import User
@@ -8,8 +10,30 @@ from taggit.managers import TaggableManager
 
 # Create your models here.
 
+## Named projections for listings, so they don't load full post bodies
+class PostQuerySet(models.QuerySet):
+    # columns needed to render a link to a post
+    LINK_FIELDS = ('id', 'title', 'slug', 'published')
+
+    def links(self, *fields):
+        return self.only(*self.LINK_FIELDS, *fields)
+
+    # link plus the thumbnail, used by the sidebar post widgets
+    def cards(self, *fields):
+        return self.links('image', *fields)
+
+    # what the RSS feed renders for each entry
+    def feed_items(self, *fields):
+        return self.links('body', *fields)
+
+    # posts older than the (published, id) position of the last one shown
+    def before(self, published, pk):
+        return self.filter(Q(published__lt=published) | Q(published=published, id__lt=pk))
+
+
+
 ## custom manager to retrieve PUBLISHED posts using Post.published.all()
-class PublishedManager(models.Manager):
+class PublishedManager(models.Manager.from_queryset(PostQuerySet)):
     def get_queryset(self):
         return super().get_queryset().filter(status=Post.Status.PUBLISHED)
     
@@ -20,6 +44,7 @@ class Post(models.Model):
 
     class Status(models.TextChoices):
         DRAFT = 'DF', 'Draft'
+        SCHEDULED = 'SC', 'Scheduled'       # published by the publish_scheduled command once due
         PUBLISHED = 'PD', 'published'
 
     title = models.CharField(max_length=255)
@@ -40,7 +65,10 @@ class Post(models.Model):
 
     class Meta:
         ordering = ['-published']
-        indexes = [models.Index(fields=['-published'])]
+        indexes = [
+            models.Index(fields=['-published']),
+            models.Index(fields=['status', '-published']),
+        ]
 
 
     def __str__(self):                  # displays object readbale name in admin site 
@@ -54,6 +82,134 @@ class Post(models.Model):
                                                   self.slug])
     
 
+## Progress of a post through the publish pipeline (see blog/publishing.py)
+class PublishJob(models.Model):
+
+    class State(models.TextChoices):
+        PENDING = 'PE', 'Pending'
+        DONE = 'DO', 'Done'
+        FAILED = 'FA', 'Failed'
+
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, related_name='publish_job')
+    stage = models.PositiveSmallIntegerField(default=0)         # index of the next stage to run
+    attempts = models.PositiveSmallIntegerField(default=0)      # failed attempts of that stage
+    state = models.CharField(max_length=2, choices=State.choices, default=State.PENDING)
+    last_error = models.TextField(blank=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+
+    class Meta:
+        ordering = ['run_after']
+        indexes = [models.Index(fields=['state', 'run_after'])]
+
+    def __str__(self):
+        return f'publish job for {self.post}'
+
+
+
+## Batched increments of per post counters
+class PostCounterQuerySet(models.QuerySet):
+    def increment(self, field, amounts):
+        """
+        Adds amounts ({post_id: amount}) to field: one INSERT for posts
+        without a row yet and one UPDATE ... FROM (VALUES ...) for all of
+        them, instead of an UPDATE per post. Posts that aren't published
+        (any more) are left out.
+        """
+        existing = set(Post.published_blogs.filter(id__in=amounts).values_list('id', flat=True))
+        # sorted, so concurrent increments lock rows in the same order
+        rows = sorted((post_id, amount) for post_id, amount in amounts.items() if post_id in existing)
+        if not rows:
+            return
+
+        with transaction.atomic(using=self.db):
+            self.bulk_create([self.model(post_id=post_id) for post_id, amount in rows], ignore_conflicts=True)
+
+            connection = connections[self.db]
+            if connection.vendor in ('postgresql', 'sqlite'):
+                table = connection.ops.quote_name(self.model._meta.db_table)
+                column = connection.ops.quote_name(self.model._meta.get_field(field).column)
+                values = ', '.join(['(%s, %s)'] * len(rows))
+                with connection.cursor() as cursor:
+                    # VALUES columns are called column1, column2 on both databases
+                    cursor.execute(f'UPDATE {table} SET {column} = {table}.{column} + v.column2 '
+                                   f'FROM (VALUES {values}) AS v WHERE {table}.post_id = v.column1',
+                                   [value for row in rows for value in row])
+            else:
+                for post_id, amount in rows:
+                    self.filter(post_id=post_id).update(**{field: F(field) + amount})
+
+
+
+## Page views of a post, written in batches by blog/counters.py
+class PostStats(models.Model):
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    views = models.PositiveBigIntegerField(default=0)
+    objects = PostCounterQuerySet.as_manager()
+
+
+    class Meta:
+        verbose_name_plural = 'post stats'
+        indexes = [models.Index(fields=['-views'])]
+
+    def __str__(self):
+        return f'stats for {self.post}'
+
+
+
+## Time decayed activity of a post, kept by blog/trending.py. Scores are
+## relative to TrendingEpoch, so they only grow and rank posts correctly
+## without rewriting every row as time passes.
+class TrendingScore(models.Model):
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True, related_name='trending')
+    score = models.FloatField(default=0)
+    objects = PostCounterQuerySet.as_manager()
+
+
+    class Meta:
+        indexes = [models.Index(fields=['-score'])]
+
+    def __str__(self):
+        return f'trending score of {self.post}'
+
+
+class TrendingEpoch(models.Model):
+    epoch = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f'trending epoch {self.epoch}'
+
+
+
+## Posts with similar text, computed by blog/related.py
+class RelatedPost(models.Model):
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='related')
+    related = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()                 # cosine similarity of the TF-IDF vectors
+
+
+    class Meta:
+        ordering = ['-score']
+        constraints = [models.UniqueConstraint(fields=['post', 'related'], name='unique_related_post')]
+        indexes = [models.Index(fields=['post', '-score'])]
+
+    def __str__(self):
+        return f'{self.related} related to {self.post}'
+
+
+# The TF-IDF model the related posts were computed from, kept in the database
+# rather than on disk so every dyno and worker shares it. There is one row.
+class RelatedPostsModel(models.Model):
+    data = models.BinaryField()                 # numpy .npz archive, see TfidfModel.save
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'related posts model of {self.updated}'
+
+
+
 ## Tis is used to associate multiple images to a post
 class PostImage(models.Model):
     post = models.ForeignKey(Post, default=None, on_delete=models.CASCADE)
@@ -64,6 +220,17 @@ class PostImage(models.Model):
     
 
 
+## Keyset pagination of a post's comment thread, newest first
+class CommentQuerySet(models.QuerySet):
+    def thread(self, post):
+        return self.filter(post=post, active=True).order_by('-created', '-id')
+
+    # comments older than the (created, id) position of the last one shown
+    def before(self, created, pk):
+        return self.filter(Q(created__lt=created) | Q(created=created, id__lt=pk))
+
+
+
 ## Comment section model to store blog post comments
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
@@ -73,11 +240,16 @@ class Comment(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
     active = models.BooleanField(default=True)
+    objects = CommentQuerySet.as_manager()
 
 
     class Meta:
         ordering = ['-created']
-        indexes = [models.Index(fields=['created'])]
+        indexes = [
+            models.Index(fields=['created']),
+            models.Index(fields=['active', '-created']),
+            models.Index(fields=['post', 'active', '-created']),
+        ]
 
     def __str__(self):
         return f'comment by {self.name} on {self.post}'
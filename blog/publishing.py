@@ -0,0 +1,131 @@
+import logging
+from contextlib import nullcontext
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Post, PublishJob
+from .templatetags.blog_tags import blog_sidebar, similar_posts_for
+from .rendering import render_markdown
+from .warmup import pages_for_post, warm_pages
+from .autocomplete import get_index
+from . import related
+
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+
+
+
+## Stages of the publish pipeline, run in order for every post going live.
+## Each stage must be safe to run again, a failed stage is retried later.
+## The body is rendered before the post goes live; related posts, fragments
+## and pages come from published posts only, so they are warmed right after.
+
+def render_body(post):
+    # fills the markdown cache used by the templates and the feed
+    render_markdown(post.body)
+
+
+def publish(post):
+    if post.status == Post.Status.PUBLISHED:
+        return
+    post.status = Post.Status.PUBLISHED
+    post.save(update_fields=['status', 'updated'])
+
+
+def update_related_posts(post):
+    related.update_post(post)
+
+
+def warm_fragments(post):
+    similar_posts_for(post)
+    blog_sidebar()
+    get_index()
+
+
+def warm_post_pages(post):
+    warm_pages(pages_for_post(post))
+
+
+STAGES = [render_body, publish, update_related_posts, warm_fragments, warm_post_pages]
+
+# Only these run in a transaction: the other stages are slow (pages are
+# rendered, related posts recomputed) and must not hold the database's write
+# lock meanwhile, they write nothing a retry wouldn't write again anyway.
+ATOMIC_STAGES = {publish}
+
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=min(30 * 2 ** attempts, 3600))
+
+
+def run_job(job):
+    """Runs the remaining stages of a job, returns True once it is done."""
+    post = job.post
+    while job.stage < len(STAGES):
+        stage = STAGES[job.stage]
+        try:
+            with transaction.atomic() if stage in ATOMIC_STAGES else nullcontext():
+                stage(post)
+        except Exception as exc:
+            job.attempts += 1
+            job.last_error = f'{stage.__name__}: {exc!r}'
+            job.run_after = timezone.now() + retry_delay(job.attempts)
+            if job.attempts >= MAX_ATTEMPTS:
+                job.state = PublishJob.State.FAILED
+            job.save()
+            logger.exception('Publish stage %s failed for post %s', stage.__name__, post.pk)
+            return False
+        job.stage += 1
+        job.attempts = 0
+        job.save(update_fields=['stage', 'attempts', 'updated'])
+
+    job.state = PublishJob.State.DONE
+    job.last_error = ''
+    job.save(update_fields=['state', 'last_error', 'updated'])
+    return True
+
+
+## Starts the pipeline over for posts, creating the jobs they don't have yet
+def restart_jobs(post_ids, run_after=None):
+    run_after = run_after or timezone.now()
+    post_ids = list(post_ids)
+    PublishJob.objects.filter(post_id__in=post_ids).update(
+        stage=0, attempts=0, state=PublishJob.State.PENDING, last_error='',
+        run_after=run_after, updated=timezone.now())
+    PublishJob.objects.bulk_create([PublishJob(post_id=post_id, run_after=run_after) for post_id in post_ids],
+                                   ignore_conflicts=True)
+
+
+## Queues the scheduled posts that are due, in batches. A post published
+## before and rescheduled since still has its finished job, which starts over.
+def enqueue_due_posts(batch_size=100, now=None):
+    now = now or timezone.now()
+    due = (Post.objects.filter(status=Post.Status.SCHEDULED, published__lte=now)
+                       .exclude(publish_job__state__in=[PublishJob.State.PENDING, PublishJob.State.FAILED])
+                       .values_list('id', flat=True))
+    queued = 0
+    while True:
+        ids = list(due[:batch_size])
+        if not ids:
+            return queued
+        restart_jobs(ids, now)
+        queued += len(ids)
+
+
+def run_pending_jobs(limit=100, now=None):
+    now = now or timezone.now()
+    jobs = (PublishJob.objects.filter(state=PublishJob.State.PENDING, run_after__lte=now)
+                              .select_related('post')
+                              .order_by('post__published')[:limit])
+    done = failed = 0
+    for job in jobs:
+        if run_job(job):
+            done += 1
+        else:
+            failed += 1
+    return done, failed
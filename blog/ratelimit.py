@@ -0,0 +1,103 @@
+import math
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+
+# Rates as "<requests>/<period>", period being s, m, h or d. Views are
+# limited per client IP; BLOG_RATELIMITS in settings overrides these.
+DEFAULT_LIMITS = {
+    'comment': '5/m',
+    'share': '3/m',
+    'contact': '3/m',
+    'search': '30/m',
+    'view': '30/m',
+}
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 60 * 60 * 24}
+
+STAT_NAMES = ('allowed', 'blocked')
+
+
+
+def parse_rate(rate):
+    count, period = rate.split('/')
+    return int(count), PERIODS[period]
+
+
+def get_rate(name):
+    limits = {**DEFAULT_LIMITS, **getattr(settings, 'BLOG_RATELIMITS', {})}
+    return parse_rate(limits[name])
+
+
+def client_ip(request):
+    header = settings.BLOG_RATELIMIT_IP_HEADER
+    if header and header in request.META:
+        # the proxy appends the address it saw, so trust only the last one
+        return request.META[header].split(',')[-1].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _incr(key, timeout):
+    cache.add(key, 0, timeout)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # expired between add() and incr()
+        cache.add(key, 1, timeout)
+        return 1
+
+
+## Sliding window check, approximated from the counts of two fixed windows
+def hit(name, ident, now=None):
+    """
+    Counts a request and returns (allowed, retry_after). The previous window
+    is weighted by how much of it still overlaps the sliding window.
+    """
+    limit, period = get_rate(name)
+    now = time.time() if now is None else now
+    window = int(now // period)
+    elapsed = now - window * period
+
+    current = _incr(f'ratelimit:{name}:{ident}:{window}', period * 2)
+    previous = cache.get(f'ratelimit:{name}:{ident}:{window - 1}', 0)
+    estimated = previous * (period - elapsed) / period + current
+
+    if estimated <= limit:
+        _incr(f'ratelimit:stats:{name}:allowed', None)
+        return True, 0
+
+    _incr(f'ratelimit:stats:{name}:blocked', None)
+    if previous and current <= limit:
+        # wait until enough of the previous window has slid out
+        retry_after = (estimated - limit) * period / previous
+    else:
+        retry_after = period - elapsed
+    return False, max(1, math.ceil(retry_after))
+
+
+def stats():
+    names = {**DEFAULT_LIMITS, **getattr(settings, 'BLOG_RATELIMITS', {})}
+    return {name: {stat: cache.get(f'ratelimit:stats:{name}:{stat}', 0) for stat in STAT_NAMES}
+            for name in names}
+
+
+
+def ratelimit(name, methods=('POST',)):
+    """Limits a view to the rate configured for name, per client IP."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method in methods:
+                allowed, retry_after = hit(name, client_ip(request))
+                if not allowed:
+                    response = HttpResponse('Too many requests, please try again later.',
+                                            status=429, content_type='text/plain')
+                    response['Retry-After'] = str(retry_after)
+                    return response
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
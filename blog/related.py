@@ -0,0 +1,302 @@
+import io
+import logging
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min
+
+from .models import Post, RelatedPost, RelatedPostsModel
+
+
+logger = logging.getLogger(__name__)
+
+
+# NumPy and SciPy are only needed to compute related posts (publish jobs and
+# management commands), so they are imported where they are used and the web
+# workers, which only read RelatedPost, never load them.
+
+WORD_RE = re.compile(r'[^\W\d_]{3,}')
+
+STOP_WORDS = frozenset('''
+    the and for are but not you all any can had her was one our out has him his how its may new now
+    see who did get let she too use that with have this will your from they been were said each which
+    their there what about would these other into more some than then them only over such also after
+    where most very just like when here
+'''.split())
+
+# title words count as much as this many mentions in the body
+TITLE_WEIGHT = 3
+
+# longer posts keep only their highest weighted terms, which bounds the size of the model
+MAX_TERMS_PER_POST = 200
+
+# terms in fewer than MIN_DF posts or more than MAX_DF of them say little about a
+# post; only applied once there are enough posts for the counts to mean something
+MIN_DF = 2
+MAX_DF = 0.5
+MIN_POSTS_FOR_PRUNING = 20
+
+
+
+def tokenize(text):
+    return [word for word in WORD_RE.findall(text.lower()) if word not in STOP_WORDS]
+
+
+def post_terms(title, body):
+    return Counter(tokenize(title) * TITLE_WEIGHT + tokenize(body))
+
+
+
+## TF-IDF vectors of the published posts
+class TfidfModel:
+    """
+    Row i of matrix is the L2 normalised TF-IDF vector of post ids[i], so
+    multiplying rows by the transposed matrix gives cosine similarities.
+    """
+
+    def __init__(self, ids, terms, idf, matrix):
+        self.ids = list(ids)
+        self.terms = list(terms)
+        self.idf = idf
+        self.matrix = matrix
+        self.vocabulary = {term: column for column, term in enumerate(self.terms)}
+        self.rows = {post_id: row for row, post_id in enumerate(self.ids)}
+
+    @classmethod
+    def fit(cls, documents):
+        """Builds the model from (post_id, title, body) documents."""
+        import numpy as np
+
+        ids, counts, df = [], [], Counter()
+        for post_id, title, body in documents:
+            terms = post_terms(title, body)
+            ids.append(post_id)
+            counts.append(terms)
+            df.update(terms.keys())
+
+        if len(ids) >= MIN_POSTS_FOR_PRUNING:
+            max_df = MAX_DF * len(ids)
+            kept = sorted(term for term, n in df.items() if MIN_DF <= n <= max_df)
+        else:
+            kept = sorted(df)
+        # smoothed idf, as if one more post contained every term
+        idf = np.log((1 + len(ids)) / (1 + np.array([df[term] for term in kept], dtype=np.float32))) + 1
+
+        model = cls(ids, kept, idf.astype(np.float32), None)
+        model.matrix = model._stack([model._vector(terms) for terms in counts])
+        return model
+
+    def _vector(self, terms):
+        # (columns, weights) of the normalised vector of a post's term counts
+        import numpy as np
+
+        pairs = [(self.vocabulary[term], n) for term, n in terms.items() if term in self.vocabulary]
+        columns = np.array([column for column, n in pairs], dtype=np.int32)
+        weights = (1 + np.log(np.array([n for column, n in pairs], dtype=np.float32))) * self.idf[columns]
+        if len(columns) > MAX_TERMS_PER_POST:
+            keep = np.argpartition(-weights, MAX_TERMS_PER_POST)[:MAX_TERMS_PER_POST]
+            columns, weights = columns[keep], weights[keep]
+        order = np.argsort(columns)
+        columns, weights = columns[order], weights[order]
+        norm = np.linalg.norm(weights)
+        return columns, (weights / norm if norm else weights)
+
+    def _stack(self, vectors):
+        import numpy as np
+        from scipy import sparse
+
+        indptr = np.zeros(len(vectors) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(columns) for columns, weights in vectors])
+        indices = np.concatenate([columns for columns, weights in vectors]) if vectors else np.zeros(0, np.int32)
+        data = np.concatenate([weights for columns, weights in vectors]) if vectors else np.zeros(0, np.float32)
+        return sparse.csr_matrix((data, indices, indptr), shape=(len(vectors), len(self.terms)), dtype=np.float32)
+
+    def transform(self, title, body):
+        """Vector of a post, in terms of the words the model already knows."""
+        return self._stack([self._vector(post_terms(title, body))])
+
+    def set_row(self, post_id, vector):
+        from scipy import sparse
+
+        row = self.rows.get(post_id)
+        if row is None:
+            self.matrix = sparse.vstack([self.matrix, vector], format='csr')
+            self.rows[post_id] = len(self.ids)
+            self.ids.append(post_id)
+        else:
+            self.matrix = sparse.vstack([self.matrix[:row], vector, self.matrix[row + 1:]], format='csr')
+
+    def remove(self, post_id):
+        from scipy import sparse
+
+        row = self.rows.get(post_id)
+        if row is None:
+            return
+        self.matrix = sparse.vstack([self.matrix[:row], self.matrix[row + 1:]], format='csr')
+        del self.ids[row]
+        self.rows = {post_id: row for row, post_id in enumerate(self.ids)}
+
+    def save(self):
+        import numpy as np
+
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, ids=np.array(self.ids, dtype=np.int64), terms=np.array(self.terms, dtype=str),
+                            idf=self.idf, data=self.matrix.data, indices=self.matrix.indices,
+                            indptr=self.matrix.indptr, shape=np.array(self.matrix.shape))
+        RelatedPostsModel.objects.update_or_create(pk=1, defaults={'data': buffer.getvalue()})
+
+    @classmethod
+    def load(cls, lock=False):
+        """
+        Returns the saved model, or None if there is none. With lock, the row
+        stays locked until the transaction ends, so that loading, changing and
+        saving the model can't interleave with another update.
+        """
+        import numpy as np
+        from scipy import sparse
+
+        saved = RelatedPostsModel.objects.filter(pk=1)
+        if lock:
+            saved = saved.select_for_update()
+        saved = saved.values_list('data', flat=True).first()
+        if saved is None:
+            return None
+        try:
+            with np.load(io.BytesIO(saved)) as archive:
+                matrix = sparse.csr_matrix((archive['data'], archive['indices'], archive['indptr']),
+                                           shape=tuple(archive['shape']))
+                return cls(archive['ids'].tolist(), archive['terms'].tolist(), archive['idf'], matrix)
+        except (OSError, ValueError, KeyError):
+            return None
+
+
+
+## Nearest neighbours by cosine similarity
+def nearest(matrix, rows, k, batch_size):
+    """
+    Yields, a batch of rows at a time, (row, neighbour rows, scores) with the
+    k most similar other rows, best first. Each batch is one sparse matrix
+    product, made dense to pick the top k.
+    """
+    import numpy as np
+
+    others = matrix.T.tocsr()
+    rows = list(rows)
+    k = min(k, matrix.shape[0] - 1)
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        if k <= 0:
+            yield [(row, np.zeros(0, np.int64), np.zeros(0, np.float32)) for row in batch]
+            continue
+        similarities = (matrix[batch] @ others).toarray()
+        # a post is not related to itself
+        similarities[np.arange(len(batch)), batch] = 0
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        results = []
+        for i, row in enumerate(batch):
+            scores = similarities[i, top[i]]
+            order = np.argsort(-scores)
+            neighbours, scores = top[i][order], scores[order]
+            results.append((row, neighbours[scores > 0], scores[scores > 0]))
+        yield results
+
+
+def store(model, results):
+    """Replaces the stored related posts of the posts in results."""
+    post_ids, related = [], []
+    for row, neighbours, scores in results:
+        post_id = model.ids[row]
+        post_ids.append(post_id)
+        related += [RelatedPost(post_id=post_id, related_id=model.ids[neighbour], score=float(score))
+                    for neighbour, score in zip(neighbours, scores)]
+    with transaction.atomic():
+        RelatedPost.objects.filter(post_id__in=post_ids).delete()
+        RelatedPost.objects.bulk_create(related, batch_size=1000)
+
+
+
+## Keeping RelatedPost up to date
+def build_all():
+    """Recomputes the related posts of every published post, returns the model."""
+    documents = Post.published_blogs.order_by('id').values_list('id', 'title', 'body').iterator(chunk_size=2000)
+    model = TfidfModel.fit(documents)
+    for results in nearest(model.matrix, range(len(model.ids)), settings.BLOG_RELATED_NEIGHBOURS,
+                           settings.BLOG_RELATED_BATCH_SIZE):
+        store(model, results)
+    RelatedPost.objects.exclude(post__status=Post.Status.PUBLISHED).delete()
+    model.save()
+    return model
+
+
+@transaction.atomic
+def update_post(post):
+    """
+    Updates the saved model and the related posts after one post changed.
+
+    Besides the post itself only the posts that listed it, or that it may
+    now be one of the nearest neighbours of, are recomputed. New words are
+    ignored until the next build_all(), which should run now and then. Until
+    the first build_all() there is no model and nothing is updated.
+    """
+    model = TfidfModel.load(lock=True)
+    if model is None:
+        logger.warning('No related posts model, run build_related_posts to compute one')
+        return
+
+    k = settings.BLOG_RELATED_NEIGHBOURS
+    affected = set(RelatedPost.objects.filter(related=post).values_list('post_id', flat=True))
+    if post.status == Post.Status.PUBLISHED:
+        import numpy as np
+
+        model.set_row(post.id, model.transform(post.title, post.body))
+        row = model.rows[post.id]
+        similarities = (model.matrix @ model.matrix[row].T).toarray().ravel()
+        similarities[row] = 0
+
+        candidates = np.argsort(-similarities)[:k * 10]
+        candidates = {model.ids[i]: similarities[i] for i in candidates if similarities[i] > 0}
+        lists = (RelatedPost.objects.filter(post_id__in=candidates).values('post_id')
+                                    .annotate(size=Count('id'), lowest=Min('score')))
+        lists = {item['post_id']: item for item in lists}
+        for post_id, similarity in candidates.items():
+            listed = lists.get(post_id)
+            if listed is None or listed['size'] < k or similarity > listed['lowest']:
+                affected.add(post_id)
+        affected.add(post.id)
+    else:
+        model.remove(post.id)
+        RelatedPost.objects.filter(post=post).delete()
+        RelatedPost.objects.filter(related=post).delete()
+
+    rows = [model.rows[post_id] for post_id in affected if post_id in model.rows]
+    for results in nearest(model.matrix, rows, k, settings.BLOG_RELATED_BATCH_SIZE):
+        store(model, results)
+    model.save()
+
+
+
+## What post pages show
+def similar_posts(post, count):
+    """
+    Published posts most similar to post, blending text similarity with the
+    share of the post's tags they have: BLOG_RELATED_TEXT_WEIGHT is the weight
+    of the text, the rest goes to the tags.
+    """
+    weight = settings.BLOG_RELATED_TEXT_WEIGHT
+    scores = Counter()
+    for related_id, score in RelatedPost.objects.filter(post=post).values_list('related_id', 'score'):
+        scores[related_id] += weight * score
+
+    tag_ids = list(post.tags.values_list('id', flat=True))
+    if tag_ids:
+        shared = (Post.published_blogs.filter(tags__in=tag_ids).exclude(id=post.id)
+                                      .values('id').annotate(same_tags=Count('tags'))
+                                      .order_by('-same_tags', '-published')[:count * 5])
+        for item in shared:
+            scores[item['id']] += (1 - weight) * item['same_tags'] / len(tag_ids)
+
+    best = [post_id for post_id, score in scores.most_common(count * 2)]
+    posts = Post.published_blogs.links().in_bulk(best)
+    return [posts[post_id] for post_id in best if post_id in posts][:count]
@@ -0,0 +1,113 @@
+import hashlib
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .cache import cached
+
+
+# Rendered markdown only depends on the text and the renderer, so it is
+# cached by the digest of the text under the renderer's name
+MARKDOWN_TIMEOUT = 60 * 60 * 24
+
+
+
+## Markdown backends, selected with BLOG_MARKDOWN_BACKEND
+class PythonMarkdownBackend:
+    """Python-Markdown, what the blog always used. Pure Python and slow."""
+
+    name = 'python-markdown'
+
+    def __init__(self, extensions=()):
+        import markdown
+        self.extensions = list(extensions)
+        self.markdown = markdown
+
+    def render(self, text):
+        return self.markdown.markdown(text, extensions=self.extensions)
+
+
+class MarkdownItBackend:
+    """CommonMark compliant markdown-it-py, several times faster than Python-Markdown."""
+
+    name = 'markdown-it'
+
+    def __init__(self, preset='commonmark', rules=('table', 'strikethrough')):
+        from markdown_it import MarkdownIt
+        self.parser = MarkdownIt(preset, {'html': True}).enable(list(rules))
+
+    def render(self, text):
+        return self.parser.render(text)
+
+
+
+## Sanitizers, selected with BLOG_MARKDOWN_SANITIZER (None keeps the html as is)
+class Nh3Sanitizer:
+    """Strips scripts, event handlers and unknown tags with nh3 (ammonia)."""
+
+    name = 'nh3'
+
+    def __init__(self, tags=None, attributes=None):
+        import nh3
+        self.nh3 = nh3
+        self.options = {}
+        if tags is not None:
+            self.options['tags'] = set(tags)
+        if attributes is not None:
+            self.options['attributes'] = {tag: set(names) for tag, names in attributes.items()}
+
+    def clean(self, html):
+        return self.nh3.clean(html, **self.options)
+
+
+
+## Backend plus sanitizer
+class Renderer:
+    def __init__(self, backend, sanitizer=None):
+        self.backend = backend
+        self.sanitizer = sanitizer
+        self.name = backend.name + (f'+{sanitizer.name}' if sanitizer else '')
+
+    def render(self, text):
+        html = self.backend.render(text)
+        if self.sanitizer is not None:
+            html = self.sanitizer.clean(html)
+        return html
+
+
+def load(path, options=None):
+    return import_string(path)(**(options or {}))
+
+
+def build_renderer(backend=None, sanitizer=None):
+    """Renderer from dotted paths, by default the ones in settings."""
+    backend = load(backend or settings.BLOG_MARKDOWN_BACKEND, settings.BLOG_MARKDOWN_OPTIONS)
+    sanitizer = sanitizer or settings.BLOG_MARKDOWN_SANITIZER
+    return Renderer(backend, load(sanitizer) if sanitizer else None)
+
+
+_renderer = None
+
+
+def get_renderer():
+    global _renderer
+    if _renderer is None:
+        _renderer = build_renderer()
+    return _renderer
+
+
+@receiver(setting_changed)
+def reset_renderer(setting, **kwargs):
+    global _renderer
+    if setting.startswith('BLOG_MARKDOWN'):
+        _renderer = None
+
+
+
+def render_markdown(text):
+    """Html of a markdown text, from the cache when it was rendered before."""
+    renderer = get_renderer()
+    key = f'markdown:{renderer.name}:{hashlib.sha1(text.encode()).hexdigest()}'
+    return cached(key, lambda: renderer.render(text), MARKDOWN_TIMEOUT)
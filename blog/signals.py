@@ -0,0 +1,101 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from taggit.models import Tag
+from .models import Post, Comment, PublishJob
+from .cache import bump_content_version
+from .surrogate import schedule_purge, post_key, tag_key
+from . import autocomplete, publishing, trending
+
+
+
+## Anything that changes what the sidebar (and other cached fragments) show
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_content_cache(sender, **kwargs):
+    bump_content_version()
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def invalidate_content_cache_on_tags(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_content_version()
+
+
+
+## Purge the pages a CDN / proxy cached for changed content
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def purge_post(sender, instance, **kwargs):
+    # posts are saved rarely, so the list pages are purged on every save
+    # rather than working out whether the post was (un)published
+    schedule_purge(post_key(instance.id), 'list', 'feed', 'sitemap')
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def purge_commented_post(sender, instance, **kwargs):
+    # list pages showing the post carry its key too, for the comment count
+    schedule_purge(post_key(instance.post_id))
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def purge_retagged_post(sender, instance, action, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if action == 'pre_clear':
+        slugs = instance.tags.values_list('slug', flat=True)
+    else:
+        slugs = Tag.objects.filter(pk__in=pk_set or ()).values_list('slug', flat=True)
+    schedule_purge(post_key(instance.pk), 'tags', *[tag_key(slug) for slug in slugs])
+
+
+
+## Posts published straight from the admin go through the warmup stages too,
+## and posts going live again (republished or rescheduled) go through them again
+@receiver(post_save, sender=Post)
+def queue_publish_job(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    jobs = PublishJob.objects.filter(post=instance)
+    if instance.status == Post.Status.PUBLISHED:
+        # the publish stage saves the post as well, its running job is left alone
+        if not jobs.filter(state=PublishJob.State.PENDING).exists():
+            publishing.restart_jobs([instance.pk])
+    elif instance.status == Post.Status.SCHEDULED and jobs.exists():
+        publishing.restart_jobs([instance.pk], run_after=instance.published)
+
+
+
+## New comments make a post trend
+@receiver(post_save, sender=Comment)
+def score_comment(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and instance.active:
+        trending.record_activity({instance.post_id: 1}, 'comment')
+
+
+
+## Keep the search-as-you-type index in step with titles and tags
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, raw=False, **kwargs):
+    if not raw:
+        autocomplete.refresh_post(instance)
+        schedule_purge('post_suggest')
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    autocomplete.remove_post(instance)
+    schedule_purge('post_suggest')
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def index_tags(sender, action, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove'):
+        autocomplete.refresh_tags(pk_set or ())
+    elif action == 'post_clear':
+        autocomplete.invalidate()
+    else:
+        return
+    schedule_purge('post_suggest')
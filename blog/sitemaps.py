@@ -9,7 +9,7 @@ class PostSitemap(Sitemap):
 
 
     def items(self):
-        return Post.published_blogs.all()
+        return Post.published_blogs.links('updated')
 
     def lastmod(self, obj):
         return obj.updated
@@ -0,0 +1,222 @@
+import json
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.db import connections
+from django.db.models import Q
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from taggit.models import Tag
+
+from .models import Post
+from .views import PostListView
+from .warmup import internal_client
+
+
+MANIFEST_NAME = '.snapshot.json'
+
+
+
+## Which pages make up the site
+
+def list_paths(tag_slug=None, num_posts=None):
+    if tag_slug:
+        num_posts = Post.published_blogs.filter(tags__slug=tag_slug).count()
+        first = reverse('blog:post_list_by_tag', args=[tag_slug])
+        page_path = lambda page: reverse('blog:post_list_by_tag_page', args=[tag_slug, page])
+    else:
+        num_posts = Post.published_blogs.count() if num_posts is None else num_posts
+        first = reverse('blog:post_list')
+        page_path = lambda page: reverse('blog:post_list_page', args=[page])
+
+    num_pages = max(1, math.ceil(num_posts / PostListView.paginate_by))
+    return [first] + [page_path(page) for page in range(2, num_pages + 1)]
+
+
+def common_paths():
+    return list_paths() + [reverse('blog:post_feed'), reverse('django.contrib.sitemaps.views.sitemap')]
+
+
+def all_paths():
+    paths = common_paths() + [reverse('blog:about')]
+    for slug in Tag.objects.filter(post__in=Post.published_blogs.all()).values_list('slug', flat=True).distinct():
+        paths += list_paths(slug)
+    paths += [post.get_absolute_url() for post in Post.published_blogs.links()]
+    return paths
+
+
+def changed_paths(since):
+    """Pages affected by posts or comments updated after since."""
+    posts = (Post.published_blogs.links()
+                 .filter(Q(updated__gt=since) | Q(comments__updated__gt=since))
+                 .distinct())
+    paths = common_paths()
+    slugs = set()
+    for post in posts:
+        paths.append(post.get_absolute_url())
+        slugs.update(post.tags.values_list('slug', flat=True))
+    for slug in sorted(slugs):
+        paths += list_paths(slug)
+    return paths
+
+
+
+## Rendering pages to files
+
+def output_file(output_dir, path):
+    relative = path.lstrip('/')
+    if not relative or relative.endswith('/'):
+        relative += 'index.html'
+    return os.path.join(output_dir, relative)
+
+
+def render_paths(paths, output_dir):
+    """Renders paths to files, runs inside the worker processes."""
+    client = internal_client()
+    failed = []
+    for path in paths:
+        response = client.get(path)
+        if response.status_code != 200:
+            failed.append(path)
+            continue
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        filename = output_file(output_dir, path)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename + '.tmp', 'wb') as f:
+            f.write(content)
+        os.replace(filename + '.tmp', filename)
+    return len(paths) - len(failed), failed
+
+
+def export(output_dir, paths, workers=None):
+    workers = workers or os.cpu_count() or 1
+    chunk_size = max(1, math.ceil(len(paths) / (workers * 4)))
+    chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+
+    # forked workers must open their own database connections. Always fork:
+    # spawned ones would import the blog modules before Django is set up
+    connections.close_all()
+    written, failed = 0, []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+        for done, chunk_failed in pool.map(render_paths, chunks, [output_dir] * len(chunks)):
+            written += done
+            failed += chunk_failed
+    return written, failed
+
+
+
+## Manifest remembering the last snapshot: when it was taken, the pages it
+## has and the tags of each post, to find the pages retagging changed
+
+def read_manifest(output_dir):
+    """The last snapshot's manifest, None if there is none or it is from an older version."""
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+        return {
+            'exported_at': parse_datetime(manifest['exported_at']),
+            'paths': manifest['paths'],
+            'post_tags': manifest['post_tags'],
+        }
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_manifest(output_dir, exported_at, paths, post_tags):
+    with open(os.path.join(output_dir, MANIFEST_NAME), 'w') as f:
+        json.dump({'exported_at': exported_at.isoformat(), 'paths': paths, 'post_tags': post_tags}, f)
+
+
+def published_post_tags():
+    """{post id: sorted tag slugs} of the published posts, with string ids as in the manifest."""
+    post_tags = {}
+    for post_id, slug in Post.published_blogs.values_list('id', 'tags__slug'):
+        slugs = post_tags.setdefault(str(post_id), [])
+        if slug is not None:
+            slugs.append(slug)
+    return {post_id: sorted(slugs) for post_id, slugs in post_tags.items()}
+
+
+def plan_snapshot(manifest, paths, post_tags):
+    """
+    (paths to render, paths to remove) to bring the snapshot in manifest up
+    to date, paths and post_tags being what the site has now.
+    """
+    current = set(paths)
+    stale = [path for path in manifest['paths'] if path not in current]
+
+    render = changed_paths(manifest['exported_at'])
+    # pages that did not exist before, e.g. a new tag or one more list page
+    previous = set(manifest['paths'])
+    render += [path for path in paths if path not in previous]
+    # posts published, unpublished, deleted or retagged since: the tag pages
+    # they are or were listed on, and their own page
+    retagged, slugs = [], set()
+    for post_id in set(manifest['post_tags']) | set(post_tags):
+        old, new = manifest['post_tags'].get(post_id), post_tags.get(post_id)
+        if old != new:
+            slugs.update(old or [])
+            slugs.update(new or [])
+            retagged.append(int(post_id))
+    for slug in sorted(slugs):
+        render += list_paths(slug)
+    render += [post.get_absolute_url() for post in Post.published_blogs.links().filter(id__in=retagged)]
+
+    return [path for path in dict.fromkeys(render) if path in current], stale
+
+
+def remove_paths(output_dir, paths):
+    """Deletes the files of paths, and the directories that leaves empty."""
+    output_dir = os.path.normpath(output_dir)
+    for path in paths:
+        filename = output_file(output_dir, path)
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
+        directory = os.path.dirname(filename)
+        while directory != output_dir and directory.startswith(output_dir):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+
+
+
+# WHITENOISE_ADD_HEADERS_FUNCTION: snapshot pages are saved as index.html,
+# give the feed and sitemap back their own content types
+def add_snapshot_headers(headers, path, url):
+    if url.endswith('/feed/'):
+        headers['Content-Type'] = 'application/rss+xml; charset=utf-8'
+    elif url.endswith('.xml'):
+        headers['Content-Type'] = 'application/xml; charset=utf-8'
+    if url.startswith('/blog/') or url.endswith('.xml'):
+        headers['Cache-Control'] = 'public, max-age=60'
+
+
+def take_snapshot(output_dir, incremental=False, workers=None):
+    """
+    Renders the site to output_dir, only the pages that changed since the
+    last snapshot if incremental, and removes the pages the site no longer
+    has. Without a manifest from the last snapshot everything is rendered.
+    """
+    started = timezone.now()
+    manifest = read_manifest(output_dir)
+    paths = all_paths()
+    post_tags = published_post_tags()
+    if incremental and manifest:
+        render, stale = plan_snapshot(manifest, paths, post_tags)
+    else:
+        render = paths
+        current = set(paths)
+        stale = [path for path in manifest['paths'] if path not in current] if manifest else []
+
+    written, failed = export(output_dir, render, workers)
+    remove_paths(output_dir, stale)
+    if not failed:
+        write_manifest(output_dir, started, paths, post_tags)
+    return written, failed
@@ -0,0 +1,72 @@
+import time
+from pathlib import Path
+
+from django.db import connections
+from django.template.loader import get_template
+from django.urls import get_resolver, reverse
+
+from .loaders import TEMPLATE_DIR
+
+
+# Work a fresh process would otherwise do on its first requests. Under
+# gunicorn it runs once in the master before the workers are forked (see
+# gunicorn.conf.py), so every worker starts with it done.
+
+
+
+## Warm up steps, each returns how many things it loaded
+def load_templates():
+    """Compiles every blog template into the cached template loader."""
+    names = [path.relative_to(TEMPLATE_DIR).as_posix() for path in sorted(Path(TEMPLATE_DIR).rglob('*.html'))]
+    for name in names:
+        get_template(name)
+    return len(names)
+
+
+def load_urls():
+    """Imports the views and builds the URL resolvers' lookup tables."""
+    resolver = get_resolver()
+    reverse('blog:post_list')
+    return len(resolver.reverse_dict)
+
+
+def load_markdown():
+    """Imports the markdown backend and sanitizer, and compiles their rules."""
+    from .rendering import get_renderer
+    get_renderer().render('*Warm* up')
+    return 1
+
+
+def load_autocomplete():
+    from .autocomplete import get_index
+    return len(get_index().entries)
+
+
+STEPS = [
+    ('templates', load_templates),
+    ('urls', load_urls),
+    ('markdown', load_markdown),
+    ('autocomplete', load_autocomplete),
+]
+
+
+def warm_up():
+    """Runs the steps, returns [(step, loaded, seconds)]."""
+    profile = []
+    for name, step in STEPS:
+        start = time.perf_counter()
+        loaded = step()
+        profile.append((name, loaded, time.perf_counter() - start))
+    return profile
+
+
+
+## Database connections can't be shared by forked processes: the master
+## closes its own after warming up and each worker opens one when it starts
+def close_databases():
+    connections.close_all()
+
+
+def connect_databases():
+    for connection in connections.all():
+        connection.ensure_connection()
@@ -0,0 +1,92 @@
+from django.http import StreamingHttpResponse
+from django.template.base import TextNode
+from django.template.context import make_context
+from django.template.loader import get_template
+from django.template.loader_tags import BLOCK_CONTEXT_KEY, BlockContext, BlockNode, ExtendsNode
+
+
+# Long pages are sent while they render: the header and the start of the
+# page leave before the post list is rendered, so the browser can fetch the
+# stylesheets meanwhile. Output is sent in chunks of about this many characters.
+CHUNK_SIZE = 8 * 1024
+
+
+
+def render_nodes(nodelist, context):
+    """
+    Yields the output of nodelist one node at a time, following {% extends %}
+    into the parent template and {% block %} into the block that overrides it,
+    the same way ExtendsNode and BlockNode render them in one piece.
+    """
+    for node in nodelist:
+        if isinstance(node, ExtendsNode):
+            yield from render_extends(node, context)
+        elif isinstance(node, BlockNode):
+            yield from render_block(node, context)
+        else:
+            yield node.render_annotated(context)
+
+
+def render_extends(node, context):
+    compiled_parent = node.get_parent(context)
+    block_context = context.render_context.setdefault(BLOCK_CONTEXT_KEY, BlockContext())
+    block_context.add_blocks(node.blocks)
+
+    # the root template supplies the default of every block it defines
+    for parent_node in compiled_parent.nodelist:
+        if not isinstance(parent_node, TextNode):
+            if not isinstance(parent_node, ExtendsNode):
+                block_context.add_blocks({
+                    block.name: block for block in compiled_parent.nodelist.get_nodes_by_type(BlockNode)
+                })
+            break
+
+    with context.render_context.push_state(compiled_parent, isolated_context=False):
+        yield from render_nodes(compiled_parent.nodelist, context)
+
+
+def render_block(node, context):
+    block_context = context.render_context.get(BLOCK_CONTEXT_KEY)
+    with context.push():
+        if block_context is None:
+            context['block'] = node
+            yield from render_nodes(node.nodelist, context)
+            return
+
+        push = block = block_context.pop(node.name)
+        if block is None:
+            block = node
+        # a copy, so {{ block.super }} renders the parent's block
+        block = type(node)(block.name, block.nodelist)
+        block.context = context
+        context['block'] = block
+        yield from render_nodes(block.nodelist, context)
+        if push is not None:
+            block_context.push(node.name, push)
+
+
+def chunked(parts, size=CHUNK_SIZE):
+    buffer, length = [], 0
+    for part in parts:
+        buffer.append(part)
+        length += len(part)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+
+def stream_template(request, template_name, context=None, status=None):
+    """Like render(), but the response is rendered while it is sent."""
+    template = get_template(template_name, using='django').template
+    context = make_context(context, request, autoescape=template.engine.autoescape)
+
+    def stream():
+        with context.render_context.push_state(template):
+            with context.bind_template(template):
+                context.template_name = template.name
+                yield from chunked(render_nodes(template.nodelist, context))
+
+    return StreamingHttpResponse(stream(), content_type='text/html; charset=utf-8', status=status)
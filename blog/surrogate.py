@@ -0,0 +1,172 @@
+import logging
+import threading
+import urllib.request
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.cache import patch_response_headers
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+
+# Keys every response of a route is tagged with, on top of the keys the view adds
+ROUTE_KEYS = {
+    'post_list': ['list'],
+    'post_list_page': ['list'],
+    'post_list_by_tag': ['list'],
+    'post_list_by_tag_page': ['list'],
+    'post_feed': ['feed'],
+    'api_post_list': ['list'],
+    'api_tag_list': ['tags'],
+    'django.contrib.sitemaps.views.sitemap': ['sitemap'],
+}
+
+
+def post_key(post_id):
+    return f'post-{post_id}'
+
+
+def tag_key(slug):
+    return f'tag-{slug}'
+
+
+# Called by views to say which content a response was built from
+def add_surrogate_keys(request, *keys):
+    if not hasattr(request, 'surrogate_keys'):
+        request.surrogate_keys = set()
+    request.surrogate_keys.update(keys)
+
+
+
+## Tags cacheable responses for the CDN / reverse proxy in front of the blog
+class SurrogateKeyMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        if not self.is_cacheable(request, response):
+            return response
+
+        keys = set(getattr(request, 'surrogate_keys', ()))
+        match = request.resolver_match
+        if match is not None:
+            keys.update(ROUTE_KEYS.get(match.url_name, [match.url_name]))
+        if keys:
+            response['Surrogate-Key'] = ' '.join(sorted(keys))
+        response['Surrogate-Control'] = f'max-age={settings.BLOG_SURROGATE_TTL}'
+        if not response.has_header('Cache-Control'):
+            patch_response_headers(response, settings.BLOG_PUBLIC_MAX_AGE)
+        return response
+
+    def is_cacheable(self, request, response):
+        if request.method not in ('GET', 'HEAD') or response.status_code != 200:
+            return False
+        if not request.path_info.startswith(tuple(settings.BLOG_FAST_PATH_PREFIXES)):
+            return False
+        # responses carrying cookies or varying on them are per visitor
+        cache_control = response.get('Cache-Control', '')
+        return (not response.cookies
+                and 'Cookie' not in response.get('Vary', '')
+                and 'private' not in cache_control
+                and 'no-cache' not in cache_control)
+
+
+
+## Purge backends
+class NullPurgeBackend:
+    def purge(self, keys):
+        pass
+
+
+class HTTPPurgeBackend:
+    """
+    Sends one request per batch to BLOG_PURGE_URL with the keys in the
+    Surrogate-Key header, which is what Fastly and Varnish (with xkey) expect.
+    """
+
+    def purge(self, keys):
+        request = urllib.request.Request(settings.BLOG_PURGE_URL, method='POST',
+                                         headers={'Surrogate-Key': ' '.join(keys)})
+        try:
+            urllib.request.urlopen(request, timeout=settings.BLOG_PURGE_TIMEOUT).close()
+        except OSError:
+            logger.exception('Purging %d surrogate keys failed', len(keys))
+
+
+class StubProxy:
+    """
+    In-process stand-in for the caching proxy, used by tests.
+
+    get() serves a cached copy when it has one and otherwise asks Django,
+    remembering the response under its surrogate keys; purge() drops every
+    cached response tagged with one of the keys.
+    """
+
+    def __init__(self):
+        from django.test import Client
+        self.client = Client()
+        self.responses = {}
+        self.purges = []
+
+    def get(self, path):
+        if path in self.responses:
+            return self.responses[path]
+        response = self.client.get(path)
+        if 'Surrogate-Key' in response:
+            self.responses[path] = response
+        return response
+
+    def purge(self, keys):
+        self.purges.append(list(keys))
+        keys = set(keys)
+        for path, response in list(self.responses.items()):
+            if keys & set(response['Surrogate-Key'].split()):
+                del self.responses[path]
+
+
+_backend = None
+
+
+def get_purge_backend():
+    global _backend
+    if _backend is None:
+        _backend = import_string(settings.BLOG_PURGE_BACKEND)()
+    return _backend
+
+
+def set_purge_backend(backend):
+    global _backend
+    _backend = backend
+
+
+
+## Collects the keys to purge during a transaction and sends them once it commits
+class PurgeDispatcher(threading.local):
+    def __init__(self):
+        self.pending = set()
+
+    def schedule(self, *keys):
+        # every call registers a flush, the first one to run sends all keys
+        # collected so far and the others find nothing left to do
+        self.pending.update(keys)
+        transaction.on_commit(self.flush)
+
+    def flush(self):
+        if not self.pending:
+            return
+        keys, self.pending = sorted(self.pending), set()
+        batch_size = settings.BLOG_PURGE_BATCH_SIZE
+        backend = get_purge_backend()
+        for start in range(0, len(keys), batch_size):
+            backend.purge(keys[start:start + batch_size])
+
+
+purge_dispatcher = PurgeDispatcher()
+
+
+def schedule_purge(*keys):
+    purge_dispatcher.schedule(*keys)
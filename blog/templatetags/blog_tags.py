@@ -1,33 +1,96 @@
 from django import template
+from django.template.loader import render_to_string
 from ..models import Post
+from ..cache import cached, content_version
+from ..trending import trending_posts
+from ..related import similar_posts
+from ..rendering import render_markdown
 from django.db.models import Count
 from django.utils.safestring import mark_safe
-import markdown
+from taggit.models import Tag
 
 register = template.Library()
 
 
+# Sidebar data is the same for every visitor, so it is cached under the
+# current content version, which is bumped whenever posts, comments or tags change
+SIDEBAR_TIMEOUT = 60 * 15
+
+
+def sidebar_key(name):
+    return f'sidebar:{content_version()}:{name}'
+
+
 # This tag will be used to display the total number of pubished blog post
 @register.simple_tag
 def total_posts():
-    return Post.published_blogs.count()
+    return cached(sidebar_key('total_posts'), Post.published_blogs.count, SIDEBAR_TIMEOUT)
+
+
 
+# This tag will be used to display the latest post. The sidebar and the
+# footer show a different number of them, so both share one list of LATEST_POSTS
+LATEST_POSTS = 4
 
 
-# This tag will be used to display the latest post
 @register.inclusion_tag('blog/post/latest_posts.html')
 def show_latest_posts(count=4):
-    latest_posts = Post.published_blogs.order_by('-published')[:count]
-    return {'latest_posts': latest_posts}
+    size = max(count, LATEST_POSTS)
+    latest_posts = cached(sidebar_key(f'latest:{size}'),
+                          lambda: list(Post.published_blogs.cards().order_by('-published')[:size]),
+                          SIDEBAR_TIMEOUT)
+    return {'latest_posts': latest_posts[:count]}
 
 
 # returns most commented post
 @register.simple_tag
 def get_most_commented_posts(count=4):
-    return Post.published_blogs.annotate(total_comments=Count('comments')).order_by('-total_comments')[:count]
+    return cached(sidebar_key(f'most_commented:{count}'),
+                  lambda: list(Post.published_blogs.links().annotate(total_comments=Count('comments')).order_by('-total_comments')[:count]),
+                  SIDEBAR_TIMEOUT)
+
+
+# returns most read posts, by the views counted in PostStats
+@register.simple_tag
+def get_most_read_posts(count=4):
+    return cached(sidebar_key(f'most_read:{count}'),
+                  lambda: list(Post.published_blogs.links().filter(stats__views__gt=0).order_by('-stats__views')[:count]),
+                  SIDEBAR_TIMEOUT)
+
+
+# returns posts with the most recent comment and view activity
+@register.simple_tag
+def get_trending_posts(count=4):
+    return cached(sidebar_key(f'trending:{count}'), lambda: list(trending_posts(count)), SIDEBAR_TIMEOUT)
+
+
+# returns tags of published posts with their post count
+@register.simple_tag
+def get_tag_cloud():
+    return cached(sidebar_key('tag_cloud'),
+                  lambda: list(Tag.objects.filter(post__in=Post.published_blogs.all()).annotate(num_posts=Count('post')).distinct()),
+                  SIDEBAR_TIMEOUT)
+
+
+# returns published posts with the most similar text and tags
+@register.simple_tag
+def similar_posts_for(post, count=4):
+    return cached(sidebar_key(f'similar:{post.id}:{count}'),
+                  lambda: similar_posts(post, count),
+                  SIDEBAR_TIMEOUT)
+
+
+# renders the whole sidebar once and shares the html between all pages
+@register.simple_tag
+def blog_sidebar():
+    html = cached(sidebar_key('html'),
+                  lambda: render_to_string('blog/post/includes/sidebar.html'),
+                  SIDEBAR_TIMEOUT)
+    return mark_safe(html)
 
 
 
+# renders markdown with the backend chosen in settings (see blog.rendering)
 @register.filter(name='markdown')
 def markdown_format(text):
-    return mark_safe(markdown.markdown(text))
\ No newline at end of file
+    return mark_safe(render_markdown(text))
@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Post, TrendingEpoch, TrendingScore
+
+
+# Forward decay: an event at time t adds weight * 2 ** ((t - epoch) / half_life)
+# to the post's score. Dividing every score by 2 ** ((now - epoch) / half_life)
+# would give the usual decayed score, but that factor is the same for every
+# post, so ranking by the stored score is already right and needs no rewrite.
+# renormalize() moves the epoch forward now and then to keep the numbers small.
+
+# Scores below this (relative to the current epoch) no longer matter and are dropped
+MIN_SCORE = 1e-6
+
+
+
+def get_epoch():
+    """Locks and returns the epoch row, so renormalize() can't move it under us."""
+    epoch, created = TrendingEpoch.objects.select_for_update().get_or_create(pk=1)
+    return epoch
+
+
+def growth(since, now):
+    return 2 ** ((now - since).total_seconds() / settings.BLOG_TRENDING_HALF_LIFE)
+
+
+def record_activity(counts, kind, now=None):
+    """Adds counts ({post_id: events}) of kind ('comment', 'view', ...) to the scores."""
+    if not counts:
+        return
+    weight = settings.BLOG_TRENDING_WEIGHTS[kind]
+    now = now or timezone.now()
+    with transaction.atomic():
+        factor = weight * growth(get_epoch().epoch, now)
+        TrendingScore.objects.increment('score', {post_id: events * factor for post_id, events in counts.items()})
+
+
+def renormalize(now=None):
+    """Moves the epoch to now, scaling the scores down to match."""
+    now = now or timezone.now()
+    with transaction.atomic():
+        epoch = get_epoch()
+        scale = 1 / growth(epoch.epoch, now)
+        TrendingScore.objects.update(score=F('score') * scale)
+        removed, _ = TrendingScore.objects.filter(score__lt=MIN_SCORE).delete()
+        epoch.epoch = now
+        epoch.save(update_fields=['epoch'])
+    return removed
+
+
+def trending_posts(count):
+    # walks the score index from the top
+    return (Post.published_blogs.links()
+                .filter(trending__score__gte=MIN_SCORE)
+                .order_by('-trending__score'))[:count]
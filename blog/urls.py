@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import views, api
 from .feeds import LatestPostsFeed
 from django.views.generic import TemplateView
 
@@ -11,12 +11,25 @@ urlpatterns = [
     # post views
     # path('', views.post_list, name='post_list'),
     path('', views.PostListView.as_view(), name='post_list'),
+    path('page/<int:page>/', views.PostListView.as_view(), name='post_list_page'),
     path('posts/tag/<slug:tag_slug>/', views.PostListView.as_view(), name='post_list_by_tag'),
+    path('posts/tag/<slug:tag_slug>/page/<int:page>/', views.PostListView.as_view(), name='post_list_by_tag_page'),
     path('<int:year>/<int:month>/<int:day>/<slug:post>/', views.post_details, name='post_details'),
     path('<int:post_id>/share/',views.post_share, name='post_share'),
     path('<int:post_id>/comment/', views.post_comment, name='post_comment'),
+    path('<int:post_id>/comments/', views.post_comments, name='post_comments'),
+    path('<int:post_id>/view/', views.post_view, name='post_view'),
     path('feed/', LatestPostsFeed(), name='post_feed'),
     path('search/', views.post_search, name='post_search'),
+    path('search/suggest/', views.post_suggest, name='post_suggest'),
     path('about/', TemplateView.as_view(template_name='blog/about.html'), name='about'),
     path('contact/', views.contact_view, name='contact'),
+    path('cache-stats/', views.cache_stats, name='cache_stats'),
+    path('csrf/', views.csrf_token, name='csrf_token'),
+
+    # read only JSON API
+    path('api/v1/posts/', api.post_list, name='api_post_list'),
+    path('api/v1/posts/<int:post_id>/', api.post_detail, name='api_post_detail'),
+    path('api/v1/posts/<int:post_id>/comments/', api.post_comments, name='api_post_comments'),
+    path('api/v1/tags/', api.tag_list, name='api_tag_list'),
 ]
\ No newline at end of file
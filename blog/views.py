@@ -12,8 +12,24 @@ from django.contrib.postgres.search import TrigramSimilarity
 from django.db.models import Q
 from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
 from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, JsonResponse
 from django.urls import reverse
+from django.core.cache import cache
+from django.contrib.admin.views.decorators import staff_member_required
+from django.middleware.csrf import get_token
+from django.views.decorators.cache import never_cache
+from .surrogate import add_surrogate_keys, post_key, tag_key
+from .templatetags.blog_tags import similar_posts_for
+from .autocomplete import get_index
+from django.views.decorators.cache import cache_control
+from .ratelimit import ratelimit, stats as ratelimit_stats
+from django.conf import settings
+from django.http import Http404
+from datetime import datetime, timedelta, timezone
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from .counters import record_view
+from .streaming import stream_template
 
 ## A view to display all published blogs from the database on request
 # def post_list(request):
@@ -40,7 +56,7 @@ class PostListView(ListView):
     """
     Alternative post list view
     """
-    queryset = Post.published_blogs.annotate(num_comments=Count('comments')).order_by('-published').all()
+    queryset = Post.published_blogs.annotate(num_comments=Count('comments')).prefetch_related('postimage_set').order_by('-published').all()
     context_object_name = 'posts'
     paginate_by = 6
     template_name = 'blog/post/list.html'
@@ -48,10 +64,11 @@ class PostListView(ListView):
     def get_queryset(self):
         qs = super().get_queryset()  # gets the initial queryset defined above
         
+        self.tag = None
         tag_slug = self.kwargs.get('tag_slug')
         if tag_slug:
-            tag = get_object_or_404(Tag, slug=tag_slug)
-            qs = qs.filter(tags__in=[tag])
+            self.tag = get_object_or_404(Tag, slug=tag_slug)
+            qs = qs.filter(tags__in=[self.tag])
             
         return qs
     
@@ -59,45 +76,116 @@ class PostListView(ListView):
         context = super().get_context_data(**kwargs)
         
         # Adding tag to the context, if tag_slug is provided
-        tag_slug = self.kwargs.get('tag_slug')
-        if tag_slug:
-            context['tag'] = get_object_or_404(Tag, slug=tag_slug)
-        
-        # Adding tags with post count to the context
-        context['tags'] = Tag.objects.filter(post__in=self.get_queryset()).annotate(num_posts=Count('post')).distinct()
+        if self.tag:
+            context['tag'] = self.tag
+            add_surrogate_keys(self.request, tag_key(self.tag.slug))
+
+        # The page changes whenever one of the posts shown on it does
+        add_surrogate_keys(self.request, *[post_key(post.id) for post in context['posts']])
         
         return context
+
+    def render_to_response(self, context, **response_kwargs):
+        # Sent while it renders, see blog.streaming
+        return stream_template(self.request, self.get_template_names()[0], context)
     
 
 
+## Comment threads (and the JSON API listings) are paged by keyset: the cursor
+## is the (timestamp, id) of the last item shown, as "<microseconds since epoch>.<id>"
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def keyset_cursor(when, pk):
+    return f'{(when - EPOCH) // timedelta(microseconds=1)}.{pk}'
+
+
+def parse_keyset_cursor(cursor):
+    """Returns the (timestamp, id) of a cursor, raises ValueError if it is not one."""
+    try:
+        micros, pk = cursor.split('.')
+        return EPOCH + timedelta(microseconds=int(micros)), int(pk)
+    except OverflowError:
+        raise ValueError(cursor)
+
+
+def comment_cursor(comment):
+    return keyset_cursor(comment.created, comment.id)
+
+
+def parse_comment_cursor(cursor):
+    try:
+        return parse_keyset_cursor(cursor)
+    except ValueError:
+        raise Http404('Invalid comment cursor')
+
+
+def comment_page(post, cursor=None):
+    """Returns a page of active comments and the cursor of the next one, if any."""
+    size = settings.BLOG_COMMENTS_PER_PAGE
+    comments = Comment.objects.thread(post)
+    if cursor:
+        comments = comments.before(*parse_comment_cursor(cursor))
+    comments = list(comments[:size + 1])
+    next_cursor = comment_cursor(comments[size - 1]) if len(comments) > size else None
+    return comments[:size], next_cursor
+
+
+
 ## A view to display the details of a particular blog post from the database on request
 def post_details(request, year, month, day, post):
-    post = get_object_or_404(Post,
+    post = get_object_or_404(Post.objects.prefetch_related('postimage_set'),
                              status=Post.Status.PUBLISHED,
                              slug=post,
                              published__year=year,
                              published__month=month,
                              published__day=day)
     
-    # List of active comments for this post
-    comments = post.comments.filter(active=True)
+    # Newest active comments for this post, older ones load on demand
+    comments, next_cursor = comment_page(post)
+    total_comments = post.comments.filter(active=True).count()
     # Form for users comment
     form = CommentForm()
 
-    # Adding tags with post count to the context
-    tags = Tag.objects.filter(post__in=Post.published_blogs.all()).annotate(num_posts=Count('post')).distinct()
-    
     # List of similar posts
-    post_tags_ids = post.tags.values_list('id', flat=True)
-    similar_posts = Post.published_blogs.filter(tags__in=post_tags_ids).exclude(id=post.id)
-    similar_posts = similar_posts.annotate(same_tags=Count('tags')).order_by('-same_tags', '-published')[:4]
+    similar_posts = similar_posts_for(post)
+
+    tag_slugs = post.tags.values_list('slug', flat=True)
+    add_surrogate_keys(request, post_key(post.id), *[tag_key(slug) for slug in tag_slugs])
 
-    return render(request, 'blog/post/details.html', {'post': post, 'comments': comments, 'form': form, 'similar_posts': similar_posts, 'tags': tags})
+    return render(request, 'blog/post/details.html', {'post': post, 'comments': comments, 'total_comments': total_comments,
+                                                      'next_cursor': next_cursor, 'form': form, 'similar_posts': similar_posts})
+
+
+
+# HTML fragment with the next page of older comments of a post
+def post_comments(request, post_id):
+    post = get_object_or_404(Post.published_blogs.links(), id=post_id)
+    comments, next_cursor = comment_page(post, request.GET.get('before'))
+    add_surrogate_keys(request, post_key(post.id))
+    return render(request, 'blog/post/includes/comment_list.html', {'post': post, 'comments': comments, 'next_cursor': next_cursor})
+
+
+
+
+# Counts a view of a post. Post pages are served from the CDN / proxy most
+# of the time, so the page pings this from the browser instead of the view
+# counting its own renders (which would also count warmups and snapshots).
+# Anyone can call it, so only published posts take a place in the buffer.
+@csrf_exempt
+@require_POST
+@ratelimit('view')
+def post_view(request, post_id):
+    if not Post.published_blogs.filter(id=post_id).exists():
+        raise Http404('No such post')
+    record_view(post_id)
+    return HttpResponse(status=204)
 
 
 
 
 # class to display form for sharing a blog, and manage its submission
+@ratelimit('share')
 def post_share(request, post_id):
     # Retrieve post by id
     post = get_object_or_404(Post, id=post_id, status=Post.Status.PUBLISHED)
@@ -124,15 +212,13 @@ def post_share(request, post_id):
 
         form = EmailPostForm()
 
-    # Adding tags with post count to the context
-    tags = Tag.objects.filter(post__in=Post.published_blogs.all()).annotate(num_posts=Count('post')).distinct()
-
-    return render(request, 'blog/post/share.html', {'post': post, 'form':form, 'sent': sent, 'tags':tags})
+    return render(request, 'blog/post/share.html', {'post': post, 'form':form, 'sent': sent})
 
 
 
 # class to handle comment submission
 @require_POST
+@ratelimit('comment')
 def post_comment(request, post_id):
     # Retrieve post by id
     post = get_object_or_404(Post, id=post_id, status=Post.Status.PUBLISHED)
@@ -147,11 +233,18 @@ def post_comment(request, post_id):
         comment.post = post
         # save the comment to the database
         comment.save()
+
+    # The post page adds comments in place and only needs the new one rendered
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        if comment is None:
+            return JsonResponse({'errors': form.errors}, status=400)
+        return render(request, 'blog/post/includes/comment_item.html', {'comment': comment}, status=201)
     return render(request, 'blog/post/comment.html', {'post':post, 'form':form, 'comment':comment})
 
 
 
 
+@ratelimit('search', methods=('GET',))
 def post_search(request):
     form = SearchForm()
     query = None
@@ -198,10 +291,23 @@ def post_search(request):
                 results = paginator.page(paginator.num_pages)
 
 
-    return render(request,'blog/post/search.html',{'form': form,'query': query,'results': results})
+    return stream_template(request, 'blog/post/search.html', {'form': form, 'query': query, 'results': results})
 
 
 
+# Search-as-you-type suggestions answered from the in-memory prefix index
+@cache_control(public=True, max_age=300)
+def post_suggest(request):
+    query = request.GET.get('q', '')[:100]
+    results = []
+    if len(query.strip()) >= 2:
+        results = [{'type': kind, 'label': label, 'url': url}
+                   for kind, label, url in get_index().search(query)]
+    return JsonResponse({'q': query, 'results': results})
+
+
+
+@ratelimit('contact')
 def contact_view(request):
     sent = False
     if request.method == 'POST':
@@ -234,3 +340,20 @@ def contact_view(request):
         form = ContactForm()
 
     return render(request, 'blog/contact.html', {'form': form, 'sent':sent})
+
+
+
+# Hit ratios of this worker's cache per key prefix, and rate limit counters, for tuning
+@staff_member_required
+def cache_stats(request):
+    stats = cache.stats() if hasattr(cache, 'stats') else {}
+    return JsonResponse({'backend': type(cache).__name__, 'prefixes': stats,
+                         'ratelimits': ratelimit_stats()})
+
+
+
+# Hands out a CSRF token on demand, so pages with the comment form don't have
+# to set the CSRF cookie themselves and stay cacheable
+@never_cache
+def csrf_token(request):
+    return JsonResponse({'token': get_token(request)})
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.urls import reverse
+
+
+
+# Host name for requests made from inside the app, must pass ALLOWED_HOSTS
+def internal_host():
+    for host in settings.ALLOWED_HOSTS:
+        if host and '*' not in host:
+            return host.lstrip('.')
+    return 'localhost'
+
+
+def internal_client():
+    from django.test import Client
+    return Client(SERVER_NAME=internal_host())
+
+
+# Requests a page through the whole Django stack, filling every cache on the way
+def internal_get(path, client=None):
+    client = client or internal_client()
+    return client.get(path)
+
+
+## Pages showing a post: its detail page and everything listing it
+def pages_for_post(post):
+    paths = [
+        reverse('blog:post_list'),
+        reverse('blog:post_feed'),
+        reverse('django.contrib.sitemaps.views.sitemap'),
+        post.get_absolute_url(),
+    ]
+    paths += [reverse('blog:post_list_by_tag', args=[slug])
+              for slug in post.tags.values_list('slug', flat=True)]
+    return paths
+
+
+def warm_pages(paths):
+    client = internal_client()
+    for path in paths:
+        response = internal_get(path, client)
+        if response.status_code != 200:
+            raise RuntimeError(f'Warming {path} returned {response.status_code}')
@@ -10,12 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 import os
+import sys
 from pathlib import Path
 from dotenv import load_dotenv
 load_dotenv()
 import django_heroku
 import dj_database_url
-import cloudinary_storage
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -55,7 +55,9 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'blog.middleware.CompressionMiddleware',
+    'blog.surrogate.SurrogateKeyMiddleware',
+    'blog.middleware.AnonymousFastPathMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -69,18 +71,87 @@ MIDDLEWARE = [
 ALLOWED_HOSTS = ['natures-narrative.herokuapp.com']
 
 
+# Sessions
+# Anonymous GETs under these prefixes skip the session entirely (see
+# blog.middleware) and may be cached publicly for BLOG_PUBLIC_MAX_AGE seconds.
+# Sessions are cached in the shared layer only: a copy kept in one worker
+# would outlive a logout on another.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'shared'
+BLOG_FAST_PATH_PREFIXES = ['/blog/', '/sitemap.xml']
+BLOG_PUBLIC_MAX_AGE = 60
+
+
+# CDN / reverse proxy
+# Public responses carry Surrogate-Key headers (see blog.surrogate) and may be
+# kept by the proxy for BLOG_SURROGATE_TTL seconds. Changes to posts, comments
+# and tags purge the affected keys by POSTing them to BLOG_PURGE_URL.
+BLOG_SURROGATE_TTL = int(os.getenv('BLOG_SURROGATE_TTL', 300))
+BLOG_PURGE_URL = os.getenv('BLOG_PURGE_URL', '')
+BLOG_PURGE_BACKEND = 'blog.surrogate.HTTPPurgeBackend' if BLOG_PURGE_URL else 'blog.surrogate.NullPurgeBackend'
+BLOG_PURGE_BATCH_SIZE = 256
+BLOG_PURGE_TIMEOUT = 5
+
+
+# Comments
+# Post pages show the newest BLOG_COMMENTS_PER_PAGE comments, older ones are
+# fetched a page at a time from blog:post_comments
+BLOG_COMMENTS_PER_PAGE = 20
+
+
+# Page views
+# Counted in memory by each worker (see blog.counters) and written to
+# PostStats every BLOG_VIEW_FLUSH_INTERVAL seconds or once
+# BLOG_VIEW_BUFFER_SIZE posts have unwritten views
+BLOG_VIEW_FLUSH_INTERVAL = 30
+BLOG_VIEW_BUFFER_SIZE = 500
+
+
+# Trending posts
+# Comments and views add to a post's score with these weights, decaying by
+# half every BLOG_TRENDING_HALF_LIFE seconds (see blog.trending). Run the
+# renormalize_trending command daily.
+BLOG_TRENDING_HALF_LIFE = 60 * 60 * 24 * 2
+BLOG_TRENDING_WEIGHTS = {'comment': 5.0, 'view': 0.1}
+
+
+# Related posts
+# TF-IDF neighbours of each post (see blog.related), computed with the
+# build_related_posts command and then updated by the publish pipeline, from
+# the model kept in the database. Similar posts blend text similarity
+# (BLOG_RELATED_TEXT_WEIGHT) with shared tags.
+BLOG_RELATED_NEIGHBOURS = 10
+BLOG_RELATED_BATCH_SIZE = 256
+BLOG_RELATED_TEXT_WEIGHT = 0.6
+
+
+# Markdown
+# Backend and optional sanitizer used to render post bodies (see
+# blog.rendering), compare them on the real posts with bench_markdown
+BLOG_MARKDOWN_BACKEND = os.getenv('BLOG_MARKDOWN_BACKEND', 'blog.rendering.MarkdownItBackend')
+BLOG_MARKDOWN_OPTIONS = {}
+BLOG_MARKDOWN_SANITIZER = os.getenv('BLOG_MARKDOWN_SANITIZER') or None
+
+
 # Activate Django-Heroku.
 django_heroku.settings(locals())
 
 
 ROOT_URLCONF = 'blogsite.urls'
 
+# The blog's templates are minified when they are compiled (see blog.loaders),
+# and compiled templates are kept by the cached loader, in development too
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
+        'APP_DIRS': False,
         'OPTIONS': {
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'blog.loaders.MinifyingLoader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -107,10 +178,105 @@ WSGI_APPLICATION = 'blogsite.wsgi.application'
 # }
 
 
+# Connections are kept for DB_CONN_MAX_AGE seconds rather than opened on every
+# request, and checked before they are reused
 DATABASES = {
-    'default': dj_database_url.config(default=os.environ.get('DATABASE_URL'))
+    'default': dj_database_url.config(default=os.environ.get('DATABASE_URL'),
+                                      conn_max_age=int(os.getenv('DB_CONN_MAX_AGE', 600)),
+                                      conn_health_checks=True)
 }
 
+# SQLite
+# An SQLite database (DATABASE_URL=sqlite:////path/to/db.sqlite3) is opened
+# through blog.backends.sqlite3, which applies these pragmas to every
+# connection and starts transactions with BEGIN IMMEDIATE, so that workers
+# writing at the same time queue up instead of failing with "database is
+# locked". Keep the database on a local disk (WAL needs shared memory) and run
+# `manage.py sqlite_maintenance` daily, e.g. with Heroku Scheduler or cron.
+if DATABASES['default'].get('ENGINE') == 'django.db.backends.sqlite3':
+    DATABASES['default']['ENGINE'] = 'blog.backends.sqlite3'
+
+BLOG_SQLITE_PRAGMAS = {
+    'busy_timeout': 5000,           # ms a writer waits for the lock
+    'journal_mode': 'wal',
+    'synchronous': 'normal',        # safe with WAL, only the last commits can be lost on power loss
+    'cache_size': -32000,           # KiB of page cache per connection
+    'mmap_size': 256 * 2 ** 20,     # bytes of the file read through mmap
+    'temp_store': 'memory',
+}
+
+
+# Startup
+# Under gunicorn (gunicorn.conf.py) the master loads the app and warms up the
+# templates, URL resolvers, markdown renderer and autocomplete index before
+# forking the workers. `manage.py startup_profile` measures the import time
+# and warm up, and checks a fresh process answers its first request within
+# BLOG_FIRST_REQUEST_TARGET seconds.
+BLOG_WARM_START = True
+BLOG_FIRST_REQUEST_TARGET = 0.1
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# The default cache keeps a small LRU in each worker in front of a shared
+# store. Set SHARED_CACHE_URL to redis://... (fastest) or to file:///path for
+# a single machine, e.g. with SQLite. Without it the database holds the shared
+# cache (`manage.py createcachetable`, run on release): content versions,
+# rate limits and recompute locks must be seen by every worker and dyno, one-off
+# dynos included. Only the tests use a local memory cache.
+SHARED_CACHE_URL = os.getenv('SHARED_CACHE_URL', '')
+TESTING = sys.argv[1:2] == ['test']
+
+if SHARED_CACHE_URL.startswith(('redis://', 'rediss://')):
+    SHARED_CACHE = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': SHARED_CACHE_URL,
+    }
+elif SHARED_CACHE_URL.startswith('file://'):
+    SHARED_CACHE = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': SHARED_CACHE_URL[len('file://'):],
+    }
+elif TESTING:
+    SHARED_CACHE = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'blog-shared',
+    }
+else:
+    SHARED_CACHE = {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'blog_cache',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    }
+
+CACHES = {
+    'default': {
+        'BACKEND': 'blog.cache.TieredCache',
+        'LOCATION': 'shared',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'L1_MAX_ENTRIES': 1000,
+            'L1_TIMEOUT': 30,
+            'STALE_TIMEOUT': 60,
+            'LOCK_TIMEOUT': 10,
+        },
+    },
+    'shared': SHARED_CACHE,
+}
+
+# Rate limits per client IP, see blog/ratelimit.py for the defaults.
+# On Heroku the client address is the last entry of X-Forwarded-For.
+BLOG_RATELIMITS = {
+    'comment': '5/m',
+    'share': '3/m',
+    'contact': '3/m',
+    'search': '30/m',
+    'view': '30/m',
+}
+BLOG_RATELIMIT_IP_HEADER = 'HTTP_X_FORWARDED_FOR' if 'DYNO' in os.environ else None
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -157,6 +323,20 @@ STATICFILES_DIRS = [
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Static snapshot of the whole site written by `manage.py export_static`.
+# When BLOG_SNAPSHOT_ROOT is set WhiteNoise serves the snapshot in front of
+# Django (restart the dynos after exporting so it picks up new files).
+BLOG_SNAPSHOT_ROOT = os.getenv('BLOG_SNAPSHOT_ROOT', '')
+
+def snapshot_headers(headers, path, url):
+    from blog.snapshot import add_snapshot_headers
+    add_snapshot_headers(headers, path, url)
+
+if BLOG_SNAPSHOT_ROOT:
+    WHITENOISE_ROOT = BLOG_SNAPSHOT_ROOT
+    WHITENOISE_INDEX_FILE = True
+    WHITENOISE_ADD_HEADERS_FUNCTION = snapshot_headers
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
@@ -180,6 +360,21 @@ CLOUDINARY_STORAGE = {
 }
 
 
-
-DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
+# Media
+# Uploads go to Cloudinary when CLOUD_NAME is set. Without it they are stored
+# under MEDIA_ROOT with a digest of their content in the name and served by
+# blog.media.serve_media: with sendfile() by gunicorn, or by the proxy when
+# BLOG_MEDIA_SENDFILE is 'x-accel-redirect' (nginx, with an internal location
+# BLOG_MEDIA_ACCEL_PREFIX aliased to MEDIA_ROOT) or 'x-sendfile' (Apache).
+# Files with a digest in their name are cached as immutable, others for
+# BLOG_MEDIA_MAX_AGE seconds.
+if CLOUDINARY_STORAGE['CLOUD_NAME']:
+    DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
+else:
+    DEFAULT_FILE_STORAGE = 'blog.media.HashedMediaStorage'
+
+BLOG_SERVE_MEDIA = not CLOUDINARY_STORAGE['CLOUD_NAME']
+BLOG_MEDIA_SENDFILE = os.getenv('BLOG_MEDIA_SENDFILE', '')
+BLOG_MEDIA_ACCEL_PREFIX = '/protected-media/'
+BLOG_MEDIA_MAX_AGE = 60 * 60 * 24
 
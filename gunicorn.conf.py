@@ -0,0 +1,40 @@
+# Gunicorn settings for the web dyno, see the Procfile
+#
+# The app is loaded and warmed up once in the master (blog.startup) and the
+# workers are forked from it, so a restarted dyno's workers answer their first
+# requests without importing and compiling everything first, and share the
+# memory holding the loaded code.
+
+import gc
+
+preload_app = True
+
+
+def warm_up(log):
+    from django.conf import settings
+    from blog.startup import warm_up
+
+    if not settings.BLOG_WARM_START:
+        return
+    for step, loaded, seconds in warm_up():
+        log.info('Warmed up %s (%d) in %.0f ms', step, loaded, seconds * 1000)
+
+
+def when_ready(server):
+    if not server.cfg.preload_app:
+        return
+    from blog.startup import close_databases
+
+    warm_up(server.log)
+    close_databases()
+    # objects loaded so far live as long as the process, leaving them out of
+    # garbage collection keeps the workers from writing to (copying) their pages
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    from blog.startup import connect_databases
+
+    if not worker.cfg.preload_app:
+        warm_up(worker.log)
+    connect_databases()